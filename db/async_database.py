@@ -1,5 +1,7 @@
 import os
 import datetime
+from collections import OrderedDict
+from dataclasses import dataclass, fields
 from sqlalchemy import (
     Column,
     Integer,
@@ -10,8 +12,17 @@ from sqlalchemy import (
     select,
     delete,
     distinct,
+    event,
+    inspect,
+    text as sql_text,
 )
-from sqlalchemy.ext.asyncio import create_async_engine, AsyncSession, async_sessionmaker
+from sqlalchemy.ext.asyncio import (
+    create_async_engine,
+    AsyncEngine,
+    AsyncSession,
+    async_sessionmaker,
+)
+from sqlalchemy.dialects.sqlite import insert
 from sqlalchemy.orm import declarative_base
 from sqlalchemy.exc import SQLAlchemyError
 
@@ -23,7 +34,17 @@ from groq_chat.filters import _AUTHORIZED_USERS
 logger = logging.getLogger(__name__)
 Base = declarative_base()
 
-db_session: Optional[AsyncSession] = None
+DB_ECHO = os.getenv("DB_ECHO", "false").lower() in ("1", "true", "yes")
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", "5"))
+DB_MAX_OVERFLOW = int(os.getenv("DB_MAX_OVERFLOW", "10"))
+DB_POOL_TIMEOUT = float(os.getenv("DB_POOL_TIMEOUT", "30"))
+DB_BUSY_TIMEOUT_MS = int(os.getenv("DB_BUSY_TIMEOUT_MS", "5000"))
+USER_SETTINGS_CACHE_SIZE = int(os.getenv("USER_SETTINGS_CACHE_SIZE", "10000"))
+OCR_CACHE_SIZE = int(os.getenv("OCR_CACHE_SIZE", "5000"))
+STT_CACHE_SIZE = int(os.getenv("STT_CACHE_SIZE", "5000"))
+
+db_engine: Optional[AsyncEngine] = None
+db_sessionmaker: Optional[async_sessionmaker] = None
 
 
 class Users(Base):
@@ -36,6 +57,11 @@ class Users(Base):
     tts_model = Column(String, nullable=True)
     stt_model = Column(String, nullable=True)
     tts_voice = Column(String, nullable=True)
+    # Квоты пользователя, NULL - значения по умолчанию, 0 - без ограничений
+    requests_per_minute = Column(Integer, nullable=True)
+    tokens_per_minute = Column(Integer, nullable=True)
+    # NULL - кеш ответов по изображениям включен
+    ocr_cache = Column(Boolean, nullable=True)
 
     def __str__(self):
         return f"tg_id: {self.tg_id}; is admin: {self.admin}"
@@ -45,6 +71,74 @@ class Users(Base):
             self.lang = os.getenv("LANG", "en")
 
 
+@dataclass(frozen=True)
+class UserSettings:
+    """Snapshot of a ``Users`` row kept in the settings cache"""
+
+    id: int
+    admin: bool
+    file_interpreter: bool
+    lang: Optional[str]
+    ocr_model: Optional[str]
+    tts_model: Optional[str]
+    stt_model: Optional[str]
+    tts_voice: Optional[str]
+    requests_per_minute: Optional[int]
+    tokens_per_minute: Optional[int]
+    ocr_cache: Optional[bool]
+
+    @classmethod
+    def from_record(cls, record: Users) -> "UserSettings":
+        return cls(**{f.name: getattr(record, f.name) for f in fields(cls)})
+
+
+class UserSettingsCache:
+    """LRU cache of user settings.
+
+    Users without a row are cached as ``None`` too. Every write bumps the
+    user's version, so a read that raced with a write does not put stale
+    settings into the cache.
+    """
+
+    def __init__(self, max_size: int):
+        self.max_size = max_size
+        self._items: OrderedDict[int, Optional[UserSettings]] = OrderedDict()
+        self._versions: dict[int, int] = {}
+
+    def get(self, user_id: int) -> tuple[bool, Optional[UserSettings]]:
+        if user_id not in self._items:
+            return False, None
+        self._items.move_to_end(user_id)
+        return True, self._items[user_id]
+
+    def version(self, user_id: int) -> int:
+        return self._versions.get(user_id, 0)
+
+    def put(
+        self,
+        user_id: int,
+        settings: Optional[UserSettings],
+        version: Optional[int] = None,
+    ) -> None:
+        if version is not None:
+            if version != self.version(user_id):
+                return
+        else:
+            self._versions[user_id] = self.version(user_id) + 1
+        self._items[user_id] = settings
+        self._items.move_to_end(user_id)
+        while len(self._items) > self.max_size:
+            evicted, _ = self._items.popitem(last=False)
+            self._versions.pop(evicted, None)
+
+    def invalidate(self, user_id: int) -> None:
+        self._items.pop(user_id, None)
+        self._versions[user_id] = self.version(user_id) + 1
+
+
+user_settings_cache = UserSettingsCache(USER_SETTINGS_CACHE_SIZE)
+
+
 class ModelsVoices(Base):
     __tablename__ = "models_voices"
     id = Column(Integer, primary_key=True, autoincrement=True)
@@ -52,26 +146,119 @@ class ModelsVoices(Base):
     voice_name = Column(String, nullable=False)
 
 
-async def initialize_db() -> AsyncSession:
-    global db_session
-
-    dirname = "./data/"
-
-    if not os.path.exists(dirname):
-        os.makedirs(dirname)
-
-    connection_string = f"sqlite+aiosqlite:///{dirname}tg-bot.db"
-    engine = create_async_engine(connection_string, echo=True)
-
-    async with engine.begin() as conn:
+class Translations(Base):
+    __tablename__ = "translations"
+    text = Column(String, primary_key=True)
+    lang = Column(String, primary_key=True)
+    translation = Column(String, nullable=False)
+
+
+class OcrCache(Base):
+    __tablename__ = "ocr_cache"
+    # Ответ зависит от истории и системного промпта пользователя
+    user_id = Column(Integer, primary_key=True, autoincrement=False)
+    file_unique_id = Column(String, primary_key=True)
+    prompt = Column(String, primary_key=True)
+    model = Column(String, primary_key=True)
+    answer = Column(String, nullable=False)
+    used_at = Column(DateTime, nullable=False, index=True)
+
+
+class SttCache(Base):
+    __tablename__ = "stt_cache"
+    # file_unique_id или sha256 содержимого файла
+    file_key = Column(String, primary_key=True)
+    prompt = Column(String, primary_key=True)
+    model = Column(String, primary_key=True)
+    transcript = Column(String, nullable=False)
+    used_at = Column(DateTime, nullable=False, index=True)
+
+
+def _set_sqlite_pragmas(dbapi_connection, connection_record):
+    cursor = dbapi_connection.cursor()
+    # WAL позволяет читать параллельно с записью
+    cursor.execute("PRAGMA journal_mode=WAL")
+    cursor.execute("PRAGMA synchronous=NORMAL")
+    cursor.execute(f"PRAGMA busy_timeout={DB_BUSY_TIMEOUT_MS}")
+    cursor.close()
+
+
+def get_engine() -> AsyncEngine:
+    global db_engine, db_sessionmaker
+
+    if db_engine is None:
+        dirname = "./data/"
+
+        if not os.path.exists(dirname):
+            os.makedirs(dirname)
+
+        connection_string = f"sqlite+aiosqlite:///{dirname}tg-bot.db"
+        db_engine = create_async_engine(
+            connection_string,
+            echo=DB_ECHO,
+            pool_size=DB_POOL_SIZE,
+            max_overflow=DB_MAX_OVERFLOW,
+            pool_timeout=DB_POOL_TIMEOUT,
+            connect_args={"timeout": DB_BUSY_TIMEOUT_MS / 1000},
+        )
+        event.listen(db_engine.sync_engine, "connect", _set_sqlite_pragmas)
+        db_sessionmaker = async_sessionmaker(
+            db_engine, expire_on_commit=False, class_=AsyncSession
+        )
+    return db_engine
+
+
+def get_session() -> AsyncSession:
+    """Returns a new session for one unit of work.
+
+    Sessions must not be shared between concurrent tasks, use it as
+    ``async with get_session() as session:``.
+    """
+    get_engine()
+    return db_sessionmaker()
+
+
+def _add_missing_columns(connection) -> None:
+    """``create_all`` does not alter existing tables, so the nullable columns
+    added later are added here"""
+    inspector = inspect(connection)
+    for table in Base.metadata.sorted_tables:
+        if not inspector.has_table(table.name):
+            continue
+        existing = {column["name"] for column in inspector.get_columns(table.name)}
+        for column in table.columns:
+            if column.name in existing or not column.nullable:
+                continue
+            column_type = column.type.compile(connection.dialect)
+            connection.execute(
+                sql_text(
+                    f"ALTER TABLE {table.name} ADD COLUMN {column.name} {column_type}"
+                )
+            )
+            logger.info(f"Добавлена колонка {table.name}.{column.name}")
+
+
+def _drop_changed_caches(connection) -> None:
+    """Cache tables whose key has changed are dropped and created anew"""
+    inspector = inspect(connection)
+    for table in (OcrCache.__table__, SttCache.__table__):
+        if not inspector.has_table(table.name):
+            continue
+        existing = set(inspector.get_pk_constraint(table.name)["constrained_columns"])
+        if existing != {column.name for column in table.primary_key}:
+            table.drop(connection)
+            logger.info(f"Кэш {table.name} пересоздан")
+
+
+async def create_tables() -> None:
+    async with get_engine().begin() as conn:
+        await conn.run_sync(_drop_changed_caches)
+        await conn.run_sync(_add_missing_columns)
         await conn.run_sync(Base.metadata.create_all)
 
-    AsyncSessionLocal = async_sessionmaker(
-        engine, expire_on_commit=False, class_=AsyncSession
-    )
 
-    session = AsyncSessionLocal()
-    db_session = session
+async def initialize_db() -> None:
+    await create_tables()
 
     admin = True
     for str_tg_id in _AUTHORIZED_USERS:
@@ -98,113 +285,287 @@ async def initialize_db() -> AsyncSession:
 
 
 async def get_or_create(model, update: bool, **kwargs):
-    session = db_session
     instance = None
-    try:
-        result = await session.execute(select(model).filter_by(id=kwargs["id"]))
-        instance = result.scalars().first()
-
-        if instance:
-            if update:
-                for key, value in kwargs.items():
-                    setattr(instance, key, value)
+    async with get_session() as session:
+        try:
+            result = await session.execute(select(model).filter_by(id=kwargs["id"]))
+            instance = result.scalars().first()
+
+            if instance:
+                if update:
+                    for key, value in kwargs.items():
+                        setattr(instance, key, value)
+                    instance.postprocessing()
+                    await session.commit()
+            else:
+                instance = model(**kwargs)
                 instance.postprocessing()
                 session.add(instance)
                 await session.commit()
-                await session.refresh(instance)
+        except SQLAlchemyError as e:
+            logger.error(
+                f"Database error in get_or_create for model {model.__name__}: {e}"
+            )
+            await session.rollback()
+            instance = None
+        except Exception as e:
+            logger.error(
+                f"An unexpected error occurred in get_or_create for model {model.__name__}: {e}"
+            )
+            await session.rollback()
+            instance = None
+
+    if model is Users:
+        if instance:
+            user_settings_cache.put(instance.id, UserSettings.from_record(instance))
         else:
-            instance = model(**kwargs)
-            instance.postprocessing()
-            session.add(instance)
-            await session.commit()
-            await session.refresh(instance)
-    except SQLAlchemyError as e:
-        logger.error(f"Database error in get_or_create for model {model.__name__}: {e}")
-        await session.rollback()
-        instance = None
-    except Exception as e:
-        logger.error(
-            f"An unexpected error occurred in get_or_create for model {model.__name__}: {e}"
-        )
-        await session.rollback()
-        instance = None
-
+            user_settings_cache.invalidate(kwargs["id"])
     return instance
 
 
 async def get_record_by_id(model, id):
-    session = db_session
     instance = None
+    version = user_settings_cache.version(id)
     try:
-        result = await session.execute(select(model).filter_by(id=id))
-        instance = result.scalars().first()
+        async with get_session() as session:
+            result = await session.execute(select(model).filter_by(id=id))
+            instance = result.scalars().first()
     except Exception as e:
         logger.error(
             f"Database error in get record for model {model.__name__} and id {id}: {e}"
         )
+        return None
 
+    if model is Users:
+        settings = UserSettings.from_record(instance) if instance else None
+        user_settings_cache.put(id, settings, version=version)
     return instance
 
 
 async def set_user_setting(user_id, setting_id, setting_value):
-    session = db_session
-    instance = await get_record_by_id(Users, id=user_id)
-    if instance:
-        setattr(instance, setting_id, setting_value)
-        await session.commit()
-        await session.refresh(instance)
+    instance = None
+    async with get_session() as session:
+        try:
+            result = await session.execute(select(Users).filter_by(id=user_id))
+            instance = result.scalars().first()
+            if instance:
+                setattr(instance, setting_id, setting_value)
+                await session.commit()
+        except SQLAlchemyError as e:
+            logger.error(f"Database error in set_user_setting for id {user_id}: {e}")
+            await session.rollback()
+            user_settings_cache.invalidate(user_id)
+            return None
+
+    user_settings_cache.put(
+        user_id, UserSettings.from_record(instance) if instance else None
+    )
     return instance
 
 
+async def get_user_settings(user_id) -> Optional[UserSettings]:
+    """Returns the user's settings, reading the database only on a cache miss"""
+    found, settings = user_settings_cache.get(user_id)
+    if not found:
+        await get_record_by_id(Users, id=user_id)
+        found, settings = user_settings_cache.get(user_id)
+    return settings
+
+
 async def get_user_setting(user_id, setting_id, default_value=None):
     result = default_value
-    instance = await get_record_by_id(Users, id=user_id)
-    if instance:
-        result = getattr(instance, setting_id)
+    settings = await get_user_settings(user_id)
+    if settings:
+        result = getattr(settings, setting_id)
     return result
 
 
 async def set_model_voices(user_id: int, model_name: str, voices: list) -> None:
-    session = db_session
-
-    # 1. Синхронизация таблицы ModelsVoices (добавление/удаление)
-    stmt = select(ModelsVoices).where(ModelsVoices.model_name == model_name)
-    result = await session.execute(stmt)
-    existing_records = result.scalars().all()
-
-    existing_voices_map = {r.voice_name: r for r in existing_records}
-    existing_voices_names = set(existing_voices_map.keys())
-    new_voices_names = set(voices)
-
-    # Удаляем старые
-    voices_to_delete = existing_voices_names - new_voices_names
-    if voices_to_delete:
-        delete_stmt = delete(ModelsVoices).where(
-            ModelsVoices.model_name == model_name,
-            ModelsVoices.voice_name.in_(voices_to_delete),
-        )
-        await session.execute(delete_stmt)
-
-    # Добавляем новые
-    for v_name in new_voices_names - existing_voices_names:
-        new_record = ModelsVoices(
-            model_name=model_name,
-            voice_name=v_name,
-            # active=False  # Раскомментируйте, если поле есть в БД
-        )
-        session.add(new_record)
+    async with get_session() as session:
+        # 1. Синхронизация таблицы ModelsVoices (добавление/удаление)
+        stmt = select(ModelsVoices).where(ModelsVoices.model_name == model_name)
+        result = await session.execute(stmt)
+        existing_records = result.scalars().all()
+
+        existing_voices_map = {r.voice_name: r for r in existing_records}
+        existing_voices_names = set(existing_voices_map.keys())
+        new_voices_names = set(voices)
+
+        # Удаляем старые
+        voices_to_delete = existing_voices_names - new_voices_names
+        if voices_to_delete:
+            delete_stmt = delete(ModelsVoices).where(
+                ModelsVoices.model_name == model_name,
+                ModelsVoices.voice_name.in_(voices_to_delete),
+            )
+            await session.execute(delete_stmt)
+
+        # Добавляем новые
+        for v_name in new_voices_names - existing_voices_names:
+            new_record = ModelsVoices(
+                model_name=model_name,
+                voice_name=v_name,
+                # active=False  # Раскомментируйте, если поле есть в БД
+            )
+            session.add(new_record)
+
+        # 2. Проверка пользователя (Users)
+        if voices:  # Проверяем только если список не пуст
+            user_stmt = select(Users).where(Users.id == user_id)
+            user_result = await session.execute(user_stmt)
+            user = user_result.scalar_one_or_none()
+
+            if user:
+                if user.tts_voice not in voices:
+                    user.tts_voice = voices[0]
 
-    # 2. Проверка пользователя (Users)
-    if voices:  # Проверяем только если список не пуст
-        user_stmt = select(Users).where(Users.id == user_id)
-        user_result = await session.execute(user_stmt)
-        user = user_result.scalar_one_or_none()
+        try:
+            await session.commit()
+        except SQLAlchemyError as e:
+            await session.rollback()
 
-        if user:
-            if user.tts_voice not in voices:
-                user.tts_voice = voices[0]
+    user_settings_cache.invalidate(user_id)
 
+
+async def get_translation(text: str, lang: str) -> Optional[str]:
     try:
-        await session.commit()
+        async with get_session() as session:
+            result = await session.execute(
+                select(Translations.translation).filter_by(text=text, lang=lang)
+            )
+            return result.scalars().first()
     except SQLAlchemyError as e:
-        await session.rollback()
+        logger.error(f"Database error in get_translation: {e}")
+        return None
+
+
+async def save_translation(text: str, lang: str, translation: str) -> None:
+    stmt = insert(Translations).values(text=text, lang=lang, translation=translation)
+    stmt = stmt.on_conflict_do_update(
+        index_elements=[Translations.text, Translations.lang],
+        set_={"translation": translation},
+    )
+    async with get_session() as session:
+        try:
+            await session.execute(stmt)
+            await session.commit()
+        except SQLAlchemyError as e:
+            logger.error(f"Database error in save_translation: {e}")
+            await session.rollback()
+
+
+async def _evict_least_recent(session: AsyncSession, table, size: int) -> None:
+    """Deletes the least recently used rows of a cache table beyond ``size``"""
+    count = await session.scalar(select(func.count()).select_from(table))
+    if count > size:
+        oldest = (
+            select(table.used_at)
+            .order_by(table.used_at)
+            .offset(count - size)
+            .limit(1)
+            .scalar_subquery()
+        )
+        await session.execute(delete(table).where(table.used_at < oldest))
+
+
+async def get_ocr_answer(
+    user_id: int, file_unique_id: str, prompt: str, model: str
+) -> Optional[str]:
+    """Returns the cached answer and marks it as recently used"""
+    key = dict(
+        user_id=user_id, file_unique_id=file_unique_id, prompt=prompt, model=model
+    )
+    async with get_session() as session:
+        try:
+            result = await session.execute(select(OcrCache).filter_by(**key))
+            record = result.scalars().first()
+            if record is None:
+                return None
+            record.used_at = datetime.datetime.now()
+            answer = record.answer
+            await session.commit()
+            return answer
+        except SQLAlchemyError as e:
+            logger.error(f"Database error in get_ocr_answer: {e}")
+            await session.rollback()
+            return None
+
+
+async def save_ocr_answer(
+    user_id: int, file_unique_id: str, prompt: str, model: str, answer: str
+) -> None:
+    """Stores the answer, evicting the least recently used ones beyond
+    ``OCR_CACHE_SIZE``"""
+    now = datetime.datetime.now()
+    stmt = insert(OcrCache).values(
+        user_id=user_id,
+        file_unique_id=file_unique_id,
+        prompt=prompt,
+        model=model,
+        answer=answer,
+        used_at=now,
+    )
+    stmt = stmt.on_conflict_do_update(
+        index_elements=[
+            OcrCache.user_id,
+            OcrCache.file_unique_id,
+            OcrCache.prompt,
+            OcrCache.model,
+        ],
+        set_={"answer": answer, "used_at": now},
+    )
+    async with get_session() as session:
+        try:
+            await session.execute(stmt)
+            await _evict_least_recent(session, OcrCache, OCR_CACHE_SIZE)
+            await session.commit()
+        except SQLAlchemyError as e:
+            logger.error(f"Database error in save_ocr_answer: {e}")
+            await session.rollback()
+
+
+async def get_stt_transcript(file_key: str, prompt: str, model: str) -> Optional[str]:
+    """Returns the cached transcript and marks it as recently used"""
+    key = dict(file_key=file_key, prompt=prompt, model=model)
+    async with get_session() as session:
+        try:
+            result = await session.execute(select(SttCache).filter_by(**key))
+            record = result.scalars().first()
+            if record is None:
+                return None
+            record.used_at = datetime.datetime.now()
+            transcript = record.transcript
+            await session.commit()
+            return transcript
+        except SQLAlchemyError as e:
+            logger.error(f"Database error in get_stt_transcript: {e}")
+            await session.rollback()
+            return None
+
+
+async def save_stt_transcript(
+    file_keys: list[str], prompt: str, model: str, transcript: str
+) -> None:
+    """Stores the transcript under each of the keys of the file, evicting the
+    least recently used ones beyond ``STT_CACHE_SIZE``"""
+    now = datetime.datetime.now()
+    async with get_session() as session:
+        try:
+            for file_key in file_keys:
+                stmt = insert(SttCache).values(
+                    file_key=file_key,
+                    prompt=prompt,
+                    model=model,
+                    transcript=transcript,
+                    used_at=now,
+                )
+                stmt = stmt.on_conflict_do_update(
+                    index_elements=[SttCache.file_key, SttCache.prompt, SttCache.model],
+                    set_={"transcript": transcript, "used_at": now},
+                )
+                await session.execute(stmt)
+            await _evict_least_recent(session, SttCache, STT_CACHE_SIZE)
+            await session.commit()
+        except SQLAlchemyError as e:
+            logger.error(f"Database error in save_stt_transcript: {e}")
+            await session.rollback()
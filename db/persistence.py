@@ -0,0 +1,283 @@
+import os
+import json
+import pickle
+import asyncio
+import logging
+from typing import Optional
+from sqlalchemy import Column, Integer, String, LargeBinary, select, delete
+from sqlalchemy.dialects.sqlite import insert
+from telegram.ext import BasePersistence, PersistenceInput
+
+from db.async_database import Base, get_engine, create_tables
+
+logger = logging.getLogger(__name__)
+
+
+class PersistentUserData(Base):
+    __tablename__ = "persistent_user_data"
+    id = Column(Integer, primary_key=True, autoincrement=False)
+    data = Column(LargeBinary, nullable=False)
+
+
+class PersistentChatData(Base):
+    __tablename__ = "persistent_chat_data"
+    id = Column(Integer, primary_key=True, autoincrement=False)
+    data = Column(LargeBinary, nullable=False)
+
+
+class PersistentBotData(Base):
+    __tablename__ = "persistent_bot_data"
+    id = Column(Integer, primary_key=True, autoincrement=False)
+    data = Column(LargeBinary, nullable=False)
+
+
+class PersistentConversation(Base):
+    __tablename__ = "persistent_conversations"
+    name = Column(String, primary_key=True)
+    key = Column(String, primary_key=True)
+    state = Column(LargeBinary, nullable=False)
+
+
+class _PickleFileUnpickler(pickle.Unpickler):
+    """Reads files of PicklePersistence, which replaces bot instances with
+    persistent ids"""
+
+    def persistent_load(self, pid):
+        return None
+
+
+class SqlitePersistence(BasePersistence[dict, dict, dict]):
+    """Stores the bot data in the bot's SQLite database, one row per user/chat.
+
+    Only the users and chats that changed since the last run are written, and
+    all rows of a run are written in one transaction. User and chat data are
+    loaded lazily, when the first update of the user/chat is processed.
+    Callback data is not stored.
+
+    If ``pickle_filepath`` points to a file of ``PicklePersistence`` and the
+    database holds no data yet, the file is migrated once and renamed.
+    ``bot_data_id`` separates the bot data of processes sharing the database.
+    """
+
+    def __init__(
+        self,
+        pickle_filepath: Optional[str] = None,
+        update_interval: float = 60,
+        bot_data_id: int = 0,
+    ):
+        super().__init__(
+            store_data=PersistenceInput(callback_data=False),
+            update_interval=update_interval,
+        )
+        self.pickle_filepath = pickle_filepath
+        self.bot_data_id = bot_data_id
+        self._ready = False
+        self._ready_lock = asyncio.Lock()
+        # (таблица, id) -> True, если данные загружены, или задача загрузки
+        self._loaded = {}
+        self._bot_data_dump = None
+        self._pending = {}
+        self._writer: Optional[asyncio.Task] = None
+
+    async def _ensure_ready(self) -> None:
+        if self._ready:
+            return
+        async with self._ready_lock:
+            if not self._ready:
+                await create_tables()
+                await self._migrate_pickle()
+                self._ready = True
+
+    async def _migrate_pickle(self) -> None:
+        if not self.pickle_filepath or not os.path.exists(self.pickle_filepath):
+            return
+
+        async with get_engine().connect() as conn:
+            result = await conn.execute(select(PersistentUserData.id).limit(1))
+            if result.first() is not None:
+                return
+
+        def load():
+            with open(self.pickle_filepath, "rb") as f:
+                return _PickleFileUnpickler(f).load()
+
+        try:
+            data = await asyncio.to_thread(load)
+        except Exception as e:
+            logger.error(f"Не удалось прочитать {self.pickle_filepath}: {e}")
+            return
+
+        for user_id, user_data in (data.get("user_data") or {}).items():
+            self._pending[(PersistentUserData, user_id)] = pickle.dumps(user_data)
+        for chat_id, chat_data in (data.get("chat_data") or {}).items():
+            self._pending[(PersistentChatData, chat_id)] = pickle.dumps(chat_data)
+        if data.get("bot_data"):
+            self._pending[(PersistentBotData, self.bot_data_id)] = pickle.dumps(
+                data["bot_data"]
+            )
+        for name, states in (data.get("conversations") or {}).items():
+            for key, state in states.items():
+                self._pending[(PersistentConversation, (name, json.dumps(key)))] = (
+                    pickle.dumps(state)
+                )
+        await self.flush()
+
+        os.replace(self.pickle_filepath, f"{self.pickle_filepath}.migrated")
+        logger.info(f"Данные перенесены из {self.pickle_filepath} в базу данных")
+
+    async def _load(self, model, id):
+        await self._ensure_ready()
+        async with get_engine().connect() as conn:
+            result = await conn.execute(select(model.data).where(model.id == id))
+            row = result.first()
+        return pickle.loads(row[0]) if row else None
+
+    async def _refresh(self, model, id, target: dict) -> None:
+        key = (model, id)
+        loaded = self._loaded.get(key)
+        if loaded is True:
+            return
+        if loaded is None:
+            loaded = asyncio.ensure_future(self._load(model, id))
+            self._loaded[key] = loaded
+        try:
+            stored = await loaded
+        except Exception:
+            self._loaded.pop(key, None)
+            raise
+        self._loaded[key] = True
+        if stored:
+            for name, value in stored.items():
+                target.setdefault(name, value)
+
+    async def _with_stored(self, model, id, data: dict) -> dict:
+        """Data of a user/chat whose stored data was never loaded in this run.
+
+        Application writes the data of every processed update, even of one no
+        handler refreshed the data for, and an empty dict must not overwrite
+        the stored row, so the stored values are kept under the new ones.
+        """
+        if self._loaded.get((model, id)) is True:
+            return data
+        # Предыдущая запись могла еще не дойти до базы
+        pending = self._pending.get((model, id))
+        if pending is not None:
+            stored = pickle.loads(pending)
+        else:
+            stored = await self._load(model, id)
+        return {**stored, **data} if stored else data
+
+    def _schedule(self, key, value: Optional[bytes]) -> None:
+        self._pending[key] = value
+        if self._writer is None or self._writer.done():
+            self._writer = asyncio.create_task(self._write_pending())
+
+    async def _write_pending(self) -> None:
+        # Даем остальным update_* этого прогона попасть в ту же транзакцию
+        await asyncio.sleep(0)
+        while self._pending:
+            batch, self._pending = self._pending, {}
+            await self._write_batch(batch)
+
+    async def _write_batch(self, batch: dict) -> None:
+        async with get_engine().begin() as conn:
+            for (model, id), value in batch.items():
+                if model is PersistentConversation:
+                    name, key = id
+                    if value is None:
+                        await conn.execute(
+                            delete(model).where(model.name == name, model.key == key)
+                        )
+                    else:
+                        stmt = insert(model).values(name=name, key=key, state=value)
+                        await conn.execute(
+                            stmt.on_conflict_do_update(
+                                index_elements=[model.name, model.key],
+                                set_={"state": value},
+                            )
+                        )
+                elif value is None:
+                    await conn.execute(delete(model).where(model.id == id))
+                else:
+                    stmt = insert(model).values(id=id, data=value)
+                    await conn.execute(
+                        stmt.on_conflict_do_update(
+                            index_elements=[model.id], set_={"data": value}
+                        )
+                    )
+
+    async def get_user_data(self) -> dict:
+        await self._ensure_ready()
+        return {}
+
+    async def get_chat_data(self) -> dict:
+        await self._ensure_ready()
+        return {}
+
+    async def get_bot_data(self) -> dict:
+        bot_data = await self._load(PersistentBotData, self.bot_data_id)
+        return bot_data if bot_data is not None else {}
+
+    async def get_callback_data(self) -> None:
+        return None
+
+    async def get_conversations(self, name: str) -> dict:
+        await self._ensure_ready()
+        model = PersistentConversation
+        async with get_engine().connect() as conn:
+            result = await conn.execute(
+                select(model.key, model.state).where(model.name == name)
+            )
+            rows = result.all()
+        return {tuple(json.loads(key)): pickle.loads(state) for key, state in rows}
+
+    async def update_conversation(self, name: str, key, new_state) -> None:
+        value = pickle.dumps(new_state) if new_state is not None else None
+        self._schedule((PersistentConversation, (name, json.dumps(key))), value)
+
+    async def update_user_data(self, user_id: int, data: dict) -> None:
+        # data - копия, сделанная Application, поэтому ее можно сериализовать в потоке
+        data = await self._with_stored(PersistentUserData, user_id, data)
+        self._schedule(
+            (PersistentUserData, user_id), await asyncio.to_thread(pickle.dumps, data)
+        )
+
+    async def update_chat_data(self, chat_id: int, data: dict) -> None:
+        data = await self._with_stored(PersistentChatData, chat_id, data)
+        self._schedule(
+            (PersistentChatData, chat_id), await asyncio.to_thread(pickle.dumps, data)
+        )
+
+    async def update_bot_data(self, data: dict) -> None:
+        dump = pickle.dumps(data)
+        if dump == self._bot_data_dump:
+            return
+        self._bot_data_dump = dump
+        self._schedule((PersistentBotData, self.bot_data_id), dump)
+
+    async def update_callback_data(self, data) -> None:
+        pass
+
+    async def drop_user_data(self, user_id: int) -> None:
+        self._loaded[(PersistentUserData, user_id)] = True
+        self._schedule((PersistentUserData, user_id), None)
+
+    async def drop_chat_data(self, chat_id: int) -> None:
+        self._loaded[(PersistentChatData, chat_id)] = True
+        self._schedule((PersistentChatData, chat_id), None)
+
+    async def refresh_user_data(self, user_id: int, user_data: dict) -> None:
+        await self._refresh(PersistentUserData, user_id, user_data)
+
+    async def refresh_chat_data(self, chat_id: int, chat_data: dict) -> None:
+        await self._refresh(PersistentChatData, chat_id, chat_data)
+
+    async def refresh_bot_data(self, bot_data: dict) -> None:
+        pass
+
+    async def flush(self) -> None:
+        if self._writer is not None and not self._writer.done():
+            await self._writer
+        while self._pending:
+            batch, self._pending = self._pending, {}
+            await self._write_batch(batch)
@@ -0,0 +1,180 @@
+import os
+import time
+import base64
+import hashlib
+import tempfile
+import asyncio
+import logging
+from typing import Optional
+from groq_chat.context_window import TOKENS_KEY
+
+logger = logging.getLogger(__name__)
+
+BLOB_DIR = "./data/blobs/"
+BLOB_URL_PREFIX = "blob://"
+DATA_URL_PREFIX = "data:{mime};base64,"
+# Через сколько запросов пользователя изображение убирается из истории
+IMAGE_HISTORY_TURNS = int(os.getenv("IMAGE_HISTORY_TURNS", "4"))
+BLOB_MAX_AGE_DAYS = int(os.getenv("BLOB_MAX_AGE_DAYS", "30"))
+IMAGE_PLACEHOLDER = "[image]"
+
+
+def blob_path(key: str) -> str:
+    return os.path.join(BLOB_DIR, key)
+
+
+def _write(key: str, data: bytes) -> None:
+    path = blob_path(key)
+    if os.path.exists(path):
+        os.utime(path)
+        return
+    os.makedirs(BLOB_DIR, exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=BLOB_DIR, suffix=".tmp")
+    with os.fdopen(fd, "wb") as f:
+        f.write(data)
+    os.replace(tmp_path, path)
+
+
+def image_mime(data: bytes) -> str:
+    if data.startswith(b"\x89PNG"):
+        return "image/png"
+    if data[:4] == b"RIFF" and data[8:12] == b"WEBP":
+        return "image/webp"
+    if data.startswith(b"GIF8"):
+        return "image/gif"
+    return "image/jpeg"
+
+
+def has_blob(key: str) -> bool:
+    return os.path.exists(blob_path(key))
+
+
+def _read_data_url(key: str) -> Optional[str]:
+    try:
+        with open(blob_path(key), "rb") as f:
+            data = f.read()
+    except FileNotFoundError:
+        return None
+    prefix = DATA_URL_PREFIX.format(mime=image_mime(data))
+    return prefix + base64.b64encode(data).decode("utf-8")
+
+
+async def put_blob(data: bytes, key: Optional[str] = None) -> str:
+    """Stores the data once on disk and returns a reference for the history.
+
+    The key is the Telegram ``file_unique_id`` if known, the content hash
+    otherwise.
+    """
+    if not key:
+        key = hashlib.sha256(data).hexdigest()
+    await asyncio.to_thread(_write, key, data)
+    return blob_url(key)
+
+
+def blob_url(key: str) -> str:
+    return BLOB_URL_PREFIX + key
+
+
+def image_part(url: str) -> dict:
+    return {"type": "image_url", "image_url": {"url": url}}
+
+
+def image_url(part: dict) -> Optional[str]:
+    if part.get("type") != "image_url":
+        return None
+    return part.get("image_url", {}).get("url")
+
+
+def has_images(messages: list) -> bool:
+    return any(
+        image_url(part) is not None
+        for message in messages
+        if not isinstance(message.get("content"), str)
+        for part in message.get("content") or []
+    )
+
+
+async def compact_image_history(messages: list) -> None:
+    """Keeps the history free of image payloads.
+
+    Inline base64 images left by older versions are moved to the blob store,
+    and images older than ``IMAGE_HISTORY_TURNS`` user turns are replaced by
+    a text placeholder (the assistant's answer that follows still describes
+    them).
+    """
+    user_turns = 0
+    for message in reversed(messages):
+        if message.get("role") != "user":
+            continue
+        user_turns += 1
+        content = message.get("content")
+        if isinstance(content, str):
+            continue
+
+        changed = False
+        for index, part in enumerate(content):
+            url = image_url(part)
+            if url is None:
+                continue
+            if user_turns > IMAGE_HISTORY_TURNS:
+                content[index] = {"type": "text", "text": IMAGE_PLACEHOLDER}
+                changed = True
+            elif url.startswith("data:"):
+                data = base64.b64decode(url.split(",", 1)[1])
+                content[index] = image_part(await put_blob(data))
+                changed = True
+        if changed:
+            message.pop(TOKENS_KEY, None)
+
+
+async def resolve_images(messages: list) -> list:
+    """Replaces blob references with base64 payloads for the API request.
+
+    Messages that carry references are copied, the history is not changed.
+    """
+    resolved = []
+    for message in messages:
+        content = message.get("content")
+        if isinstance(content, str) or not any(
+            (image_url(part) or "").startswith(BLOB_URL_PREFIX) for part in content
+        ):
+            resolved.append(message)
+            continue
+
+        parts = []
+        for part in content:
+            url = image_url(part) or ""
+            if not url.startswith(BLOB_URL_PREFIX):
+                parts.append(part)
+                continue
+            data_url = await asyncio.to_thread(
+                _read_data_url, url[len(BLOB_URL_PREFIX) :]
+            )
+            if data_url:
+                parts.append(image_part(data_url))
+            else:
+                parts.append({"type": "text", "text": IMAGE_PLACEHOLDER})
+        resolved.append({**message, "content": parts})
+    return resolved
+
+
+def _prune(max_age: float) -> int:
+    if not os.path.isdir(BLOB_DIR):
+        return 0
+    removed = 0
+    deadline = time.time() - max_age
+    for name in os.listdir(BLOB_DIR):
+        path = blob_path(name)
+        if os.path.getmtime(path) < deadline:
+            os.remove(path)
+            removed += 1
+    return removed
+
+
+async def prune_blobs() -> None:
+    """Removes blobs that are older than any history could still reference"""
+    if BLOB_MAX_AGE_DAYS <= 0:
+        return
+    removed = await asyncio.to_thread(_prune, BLOB_MAX_AGE_DAYS * 24 * 3600)
+    if removed:
+        logger.info("Удалено устаревших изображений: %s", removed)
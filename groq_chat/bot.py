@@ -1,4 +1,6 @@
 import os
+import asyncio
+from typing import Optional
 from telegram import Update
 from telegram.ext import (
     Application,
@@ -6,7 +8,6 @@ from telegram.ext import (
     MessageHandler,
     CallbackQueryHandler,
     ConversationHandler,
-    PicklePersistence,
     filters,
 )
 from groq_chat.llm_conversation import llm_request, llm_image_request, llm_audio_request
@@ -26,6 +27,7 @@ from groq_chat.tts_handler import (
 from groq_chat.handlers import (
     start,
     new_command_handler,
+    stop_command_handler,
     SYSTEM_PROMPT_SP,
     CANCEL_SP,
     START_CHANGE_LANG,
@@ -41,8 +43,18 @@ from groq_chat.handlers import (
     error_handler,
 )
 from groq_chat.groq_chat import set_chatbot
-from groq import AsyncGroq
-import httpx
+from groq_chat.blob_store import prune_blobs
+from groq_chat.model_catalog import model_catalog
+from groq_chat.update_processor import ChatOrderedUpdateProcessor
+from groq_chat.http_server import HttpServer, run_webhook, HTTP_PORT, WEBHOOK_URL
+from groq_chat.key_pool import GroqKeyPool, api_keys_from_env
+from groq_chat.cancellation import generations
+from groq_chat.media_groups import media_groups
+from groq_chat.http_pool import (
+    groq_http_client,
+    telegram_request,
+    TELEGRAM_MAX_CONNECTIONS,
+)
 from groq_chat.filters import (
     AuthFilter,
     MessageFilter,
@@ -57,17 +69,28 @@ from translate.translate import translate
 import groq_chat.command_descriptions as com_descr
 
 from db.async_database import initialize_db
+from db.persistence import SqlitePersistence
 
 load_dotenv()
 
 logger = logging.getLogger(__name__)
 
+http_server = None
+# Номер рабочего процесса в режиме нескольких процессов (WORKERS > 1)
+shard_index = None
+
+
+def on_update_arrival(update: object) -> None:
+    generations.preempt(update)
+    media_groups.add_update(update)
+
 
 async def set_bot_commands(app):
 
     commands = [
         BotCommand("start", com_descr.start),
         BotCommand("panel", com_descr.panel),
+        BotCommand("stop", com_descr.stop),
         BotCommand("tts", com_descr.tts),
     ]
     # `app.bot` уже инициализирован к моменту вызова `run_polling()`
@@ -77,25 +100,70 @@ async def set_bot_commands(app):
 
 async def init_chatbot(app):
     set_chatbot(
-        AsyncGroq(api_key=os.getenv("GROQ_API_KEY"), http_client=httpx.AsyncClient())
+        GroqKeyPool(
+            api_keys_from_env(os.getenv("GROQ_API_KEYS"), os.getenv("GROQ_API_KEY")),
+            http_client_factory=groq_http_client,
+        )
     )
+    try:
+        await model_catalog.refresh()
+    except Exception as e:
+        logger.warning(f"Не удалось загрузить список моделей: {e}")
 
 
 async def prepare_bot(app):
     await initialize_db()
-    await set_bot_commands(app)
+    if shard_index is None or shard_index == 0:
+        await prune_blobs()
+        await set_bot_commands(app)
     await init_chatbot(app)
+    if HTTP_PORT and not WEBHOOK_URL and shard_index is None:
+        # В режиме polling сервер нужен только для health и metrics
+        global http_server
+        http_server = HttpServer(app, webhook=False)
+        await http_server.start()
 
 
-def start_bot():
-    logger.info("Starting bot")
+async def stop_bot(app):
+    if http_server:
+        await http_server.stop()
+
+
+def build_application(shard: Optional[int] = None) -> Application:
+    """Builds the application with all handlers.
+
+    ``shard`` is the number of the worker process in the multi-process mode.
+    The worker keeps its bot data in its own row and does not migrate the
+    pickle file, which the supervisor has done before starting it.
+    """
+    global shard_index
+    shard_index = shard
 
-    app_builder = Application.builder().token(os.getenv("BOT_TOKEN"))
+    app_builder = (
+        Application.builder()
+        .token(os.getenv("BOT_TOKEN"))
+        .request(telegram_request("telegram", TELEGRAM_MAX_CONNECTIONS))
+        .get_updates_request(telegram_request("telegram_updates", 1))
+    )
+
+    concurrent_updates = int(os.getenv("CONCURRENT_UPDATES", "16"))
+    if concurrent_updates > 1:
+        app_builder.concurrent_updates(
+            ChatOrderedUpdateProcessor(
+                concurrent_updates,
+                int(os.getenv("MAX_PENDING_UPDATES", "256")),
+                on_arrival=on_update_arrival,
+            )
+        )
 
     dirname = "./data/"
     if not os.path.exists(dirname):
         os.makedirs(dirname)
-    persistence = PicklePersistence(filepath=f"{dirname}telegram-bot-data")
+    persistence = SqlitePersistence(
+        pickle_filepath=f"{dirname}telegram-bot-data" if shard is None else None,
+        bot_data_id=shard or 0,
+        update_interval=float(os.getenv("PERSISTENCE_UPDATE_INTERVAL", "60")),
+    )
     app_builder.persistence(persistence)
 
     # Build the app
@@ -106,6 +174,7 @@ def start_bot():
     app.add_handler(CommandHandler("model", model_command_handler, filters=AuthFilter))
     app.add_handler(CommandHandler("info", show_model_info, filters=AuthFilter))
     app.add_handler(CommandHandler("new", new_command_handler, filters=AuthFilter))
+    app.add_handler(CommandHandler("stop", stop_command_handler, filters=AuthFilter))
 
     # Установка промпта
     app.add_handler(
@@ -186,5 +255,16 @@ def start_bot():
     else:
         app.post_init = prepare_bot
 
+    app.post_stop = stop_bot
+    return app
+
+
+def start_bot():
+    logger.info("Starting bot")
+    app = build_application()
+
     # Run the bot until the user presses Ctrl-C
-    app.run_polling(allowed_updates=Update.ALL_TYPES)
+    if WEBHOOK_URL:
+        asyncio.run(run_webhook(app))
+    else:
+        app.run_polling(allowed_updates=Update.ALL_TYPES)
@@ -0,0 +1,133 @@
+import os
+import asyncio
+import logging
+import weakref
+from typing import Awaitable, Optional, TypeVar
+from telegram import Update
+import groq_chat.metrics as metrics
+
+logger = logging.getLogger(__name__)
+
+# Новое сообщение пользователя отменяет ответ, который еще генерируется
+CANCEL_ON_NEW_MESSAGE = os.getenv("CANCEL_ON_NEW_MESSAGE", "true").lower() in (
+    "1",
+    "true",
+    "yes",
+)
+# Оставлять ли в чате и в истории часть ответа, сгенерированную до отмены
+KEEP_PARTIAL_ON_CANCEL = os.getenv("KEEP_PARTIAL_ON_CANCEL", "true").lower() in (
+    "1",
+    "true",
+    "yes",
+)
+
+STOP_COMMAND = "/stop"
+NEW_COMMAND = "/new"
+
+# Причина отмены: история пользователя сбрасывается, ответ в нее не пишется
+RESET = "reset"
+
+T = TypeVar("T")
+
+
+class GenerationCancelled(Exception):
+    pass
+
+
+def _command(text: str) -> Optional[str]:
+    if not text.startswith("/"):
+        return None
+    return text.split(maxsplit=1)[0].split("@", 1)[0].lower()
+
+
+class Generations:
+    """In-flight work of each user in each chat, so it can be cancelled.
+
+    The work runs in a task of its own. Cancelling it does not cancel the
+    handler that awaits it, which gets ``GenerationCancelled`` instead. All
+    the work of a user in a chat, running or queued, is cancelled at once.
+    The cancelled work can look up why it was cancelled with ``reason``.
+    """
+
+    def __init__(self):
+        self._tasks: dict[tuple, set[asyncio.Task]] = {}
+        self._stopped: set[tuple] = set()
+        self._reasons: weakref.WeakKeyDictionary[asyncio.Task, str] = (
+            weakref.WeakKeyDictionary()
+        )
+
+    @staticmethod
+    def key(update: Update) -> Optional[tuple]:
+        if not update.effective_chat or not update.effective_user:
+            return None
+        return update.effective_chat.id, update.effective_user.id
+
+    async def run(self, key: Optional[tuple], work: Awaitable[T]) -> T:
+        task = asyncio.ensure_future(work)
+        if key is None:
+            return await task
+        self._tasks.setdefault(key, set()).add(task)
+        try:
+            return await task
+        except asyncio.CancelledError:
+            if task.cancelled() and not asyncio.current_task().cancelling():
+                raise GenerationCancelled() from None
+            raise
+        finally:
+            tasks = self._tasks.get(key)
+            if tasks is not None:
+                tasks.discard(task)
+                if not tasks:
+                    del self._tasks[key]
+
+    def cancel(self, key: Optional[tuple], reason: Optional[str] = None) -> bool:
+        running = [task for task in self._tasks.pop(key, ()) if not task.done()]
+        for task in running:
+            if reason is not None:
+                self._reasons[task] = reason
+            task.cancel()
+            metrics.inc("generations_cancelled_total")
+        return bool(running)
+
+    def cancel_user(self, user_id: int, reason: Optional[str] = None) -> bool:
+        """Cancels the work of the user in all chats, the history is shared"""
+        cancelled = False
+        for key in [key for key in self._tasks if key[1] == user_id]:
+            cancelled = self.cancel(key, reason) or cancelled
+        return cancelled
+
+    def reason(self) -> Optional[str]:
+        """Why the current work was cancelled, if a reason was given"""
+        task = asyncio.current_task()
+        return self._reasons.get(task) if task is not None else None
+
+    def preempt(self, update: object) -> None:
+        """Called when an update arrives, before it waits for the updates of
+        its chat: ``/stop``, ``/new`` and a new message supersede the work
+        that is still running"""
+        if not isinstance(update, Update) or not update.message:
+            return
+        key = self.key(update)
+        text = update.message.text
+        if key is None or text is None:
+            return
+        command = _command(text)
+        if command == STOP_COMMAND:
+            if self.cancel(key):
+                self._stopped.add(key)
+        elif command == NEW_COMMAND:
+            self.cancel_user(key[1], RESET)
+        elif command is None and CANCEL_ON_NEW_MESSAGE:
+            self.cancel(key)
+
+    def stop(self, update: Update) -> bool:
+        """Cancels the work of the ``/stop`` sender, returns whether anything
+        was running (it may have been cancelled already in ``preempt``)"""
+        key = self.key(update)
+        if key in self._stopped:
+            self._stopped.discard(key)
+            return True
+        return self.cancel(key)
+
+
+generations = Generations()
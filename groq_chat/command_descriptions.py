@@ -6,3 +6,4 @@ model = (
 info = "/info - get info about the current model"
 panel = "/panel - control panel"
 tts = "/tts - convert text to speech"
+stop = "/stop - stop generating the current response"
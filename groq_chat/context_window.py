@@ -0,0 +1,88 @@
+import os
+from typing import Optional
+from groq_chat.model_catalog import model_catalog
+
+# Бюджет токенов истории на один запрос
+CONTEXT_TOKEN_BUDGET = int(os.getenv("CONTEXT_TOKEN_BUDGET", "8000"))
+# Бюджеты для отдельных моделей: "model1:4000,model2:16000"
+MODEL_TOKEN_BUDGETS = {
+    name.strip(): int(budget)
+    for name, _, budget in (
+        item.partition(":")
+        for item in os.getenv("MODEL_TOKEN_BUDGETS", "").split(",")
+        if item.strip()
+    )
+}
+
+CHARS_PER_TOKEN = 4
+MESSAGE_OVERHEAD_TOKENS = 4
+IMAGE_TOKENS = 1024
+TOKENS_KEY = "_tokens"
+
+
+def get_token_budget(model: str) -> int:
+    budget = MODEL_TOKEN_BUDGETS.get(model, CONTEXT_TOKEN_BUDGET)
+    info = model_catalog.get(model)
+    if info and info.context_window:
+        # Часть окна модели оставляем под ответ
+        budget = min(budget, info.context_window * 3 // 4)
+    return budget
+
+
+def estimate_tokens(message: dict) -> int:
+    """Estimates the number of tokens of a history message.
+
+    The estimate is cached on the message under a private key, which is
+    stripped before the message is sent to the API.
+    """
+    tokens = message.get(TOKENS_KEY)
+    if tokens is None:
+        tokens = MESSAGE_OVERHEAD_TOKENS
+        content = message.get("content") or ""
+        if isinstance(content, str):
+            tokens += len(content) // CHARS_PER_TOKEN
+        else:
+            for part in content:
+                if part.get("type") == "text":
+                    tokens += len(part.get("text", "")) // CHARS_PER_TOKEN
+                else:
+                    tokens += IMAGE_TOKENS
+        message[TOKENS_KEY] = tokens
+    return tokens
+
+
+def public_message(message: dict) -> dict:
+    return {key: value for key, value in message.items() if not key.startswith("_")}
+
+
+def build_request_messages(
+    history: list, system_prompt: Optional[str], budget: int
+) -> list:
+    """Selects the newest messages of the history that fit into the budget.
+
+    System messages (the system prompt and the ones stored in the history)
+    are always kept, and the latest message is kept even if it alone exceeds
+    the budget.
+    """
+    pinned = []
+    if system_prompt:
+        pinned.append({"role": "system", "content": system_prompt})
+    turns = []
+    for message in history:
+        if message.get("role") == "system":
+            if not any(p["content"] == message.get("content") for p in pinned):
+                pinned.append(message)
+        else:
+            turns.append(message)
+
+    remaining = budget - sum(estimate_tokens(message) for message in pinned)
+    selected = []
+    for message in reversed(turns):
+        tokens = estimate_tokens(message)
+        if selected and tokens > remaining:
+            break
+        selected.append(message)
+        remaining -= tokens
+    selected.reverse()
+
+    return [public_message(message) for message in pinned + selected]
@@ -2,7 +2,7 @@ import logging
 from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup
 from telegram.ext import ContextTypes
 from telegram.constants import ChatAction
-from translate.translate import translate
+from translate.translate import translate, translate_texts, get_lang
 import db.async_database as db
 from sqlalchemy import inspect as sa_inspect
 from sqlalchemy.orm.state import AttributeState
@@ -12,7 +12,8 @@ from groq_chat.handlers import (
     show_system_prompt,
     clear_system_prompt,
 )
-from groq_chat.groq_chat import get_default_model
+from groq_chat.groq_chat import get_user_model
+from groq_chat.keyboards import keyboards
 from telegram.error import BadRequest
 
 logger = logging.getLogger(__name__)
@@ -22,47 +23,66 @@ async def control_panel_builder(
     update: Update, context: ContextTypes.DEFAULT_TYPE
 ) -> None:
     await update.message.chat.send_action(ChatAction.TYPING)
-    button_list = [
+    lang = await get_lang(context)
+    reply_markup = await keyboards.get("control_panel", lang, build_control_panel)
+    message = await panel_banner(update, context)
+    await update.message.reply_text(message, reply_markup=reply_markup)
+
+
+async def build_control_panel(lang: str) -> InlineKeyboardMarkup:
+    (
+        select_model,
+        model_info,
+        reset_context,
+        show_prompt,
+        set_prompt,
+        clear_prompt,
+        code_in_file,
+        code_in_message,
+        ocr_cache_on,
+        ocr_cache_off,
+        change_lang,
+    ) = await translate_texts(
         [
-            create_key("select_model", await translate("Select a model", context)),
-            create_key("model_info", await translate("Model Information", context)),
+            "Select a model",
+            "Model Information",
+            "Reset context (delete message history)",
+            "Show sytem prompt",
+            "Set system prompt",
+            "Clear system prompt",
+            "Export text blocks to files",
+            "Output text blocks to messages",
+            "Cache answers about images",
+            "Do not cache answers about images",
+            "Change language",
         ],
+        lang,
+    )
+    button_list = [
         [
-            create_key(
-                "reset_context",
-                await translate("Reset context (delete message history)", context),
-            ),
+            create_key("select_model", select_model),
+            create_key("model_info", model_info),
         ],
-        [create_key("show_prompt", await translate("Show sytem prompt", context))],
+        [create_key("reset_context", reset_context)],
+        [create_key("show_prompt", show_prompt)],
         [
-            InlineKeyboardButton(
-                text=await translate("Set system prompt", context),
-                callback_data="set_system_prompt",
-            ),
-            create_key("clear_prompt", await translate("Clear system prompt", context)),
+            InlineKeyboardButton(text=set_prompt, callback_data="set_system_prompt"),
+            create_key("clear_prompt", clear_prompt),
         ],
+        [create_key("code_in_file", code_in_file)],
+        [create_key("code_in_message", code_in_message)],
         [
-            create_key(
-                "code_in_file", await translate("Export text blocks to files", context)
-            )
-        ],
-        [
-            create_key(
-                "code_in_message",
-                await translate("Output text blocks to messages", context),
-            )
+            create_key("ocr_cache_on", ocr_cache_on),
+            create_key("ocr_cache_off", ocr_cache_off),
         ],
         [
             InlineKeyboardButton(
-                text=f"Change language / {await translate("Change language", context)}",
+                text=f"Change language / {change_lang}",
                 callback_data="change_lang",
             ),
         ],
     ]
-
-    reply_markup = InlineKeyboardMarkup(button_list)
-    message = await panel_banner(update, context)
-    await update.message.reply_text(message, reply_markup=reply_markup)
+    return InlineKeyboardMarkup(button_list)
 
 
 async def control_panel_executor(
@@ -76,6 +96,10 @@ async def control_panel_executor(
     if need_execute:
         await change_file_interpreter(update, context, detail_command)
 
+    need_execute, detail_command = command_matches_pattern(command, "ocr_cache_")
+    if need_execute:
+        await change_ocr_cache(update, context, detail_command)
+
     need_execute, detail_command = command_matches_pattern(command, "select_model")
     if need_execute:
         await model_command_handler(update, context)
@@ -111,7 +135,7 @@ async def user_settings_baner(db_record):
 
 
 async def panel_banner(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    message = f"{await translate('Current model', context)}: {context.user_data.get('model', await get_default_model())}"
+    message = f"{await translate('Current model', context)}: {await get_user_model(context)}"
     db_user = await db.get_record_by_id(db.Users, context._user_id)
     if db_user:
         message += "\n\n" + await translate("User settings:", context)
@@ -127,10 +151,17 @@ def command_matches_pattern(command, pattern):
 
 
 async def change_file_interpreter(update, context, command):
-    setting_id = "file_interpreter"
-    db_record = await db.set_user_setting(
-        context._user_id, setting_id, command.startswith("file")
+    await change_setting(
+        update, context, "file_interpreter", command.startswith("file")
     )
+
+
+async def change_ocr_cache(update, context, command):
+    await change_setting(update, context, "ocr_cache", command == "on")
+
+
+async def change_setting(update, context, setting_id, value):
+    db_record = await db.set_user_setting(context._user_id, setting_id, value)
     if db_record:
         getattr(db_record, setting_id, None)
         message = await panel_banner(update, context)
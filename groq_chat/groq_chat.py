@@ -1,16 +1,33 @@
 import os
+from typing import Awaitable, Callable, Optional
 from dotenv import load_dotenv
 import groq
 from telegram.ext import ContextTypes
 from translate.translate import translate
 from io import BytesIO
 from db.async_database import get_user_setting
+from groq_chat.context_window import (
+    build_request_messages,
+    get_token_budget,
+    estimate_tokens,
+    CHARS_PER_TOKEN,
+)
+from groq_chat.model_catalog import model_catalog
+from groq_chat.blob_store import (
+    compact_image_history,
+    resolve_images,
+    image_part,
+    has_images,
+)
+from groq_chat.model_catalog import TEXT, VISION, STT, TTS
+from groq_chat.model_router import model_router, request_modality
+from groq_chat.scheduler import scheduler, QuotaExceeded
+from groq_chat.long_audio import transcribe_long_audio
 
 load_dotenv()
 
 # Create a ChatBot
 chatbot = None
-available_models = None
 
 
 def get_chatbot():
@@ -20,23 +37,20 @@ def get_chatbot():
 def set_chatbot(cb):
     global chatbot
     chatbot = cb
+    model_catalog.set_client(cb)
 
 
-async def get_groq_models() -> dict:
-    global available_models
-    if chatbot:
-        models = await chatbot.models.list()
-        available_models = [model.id for model in models.data]
-        if available_models:
-            available_models.sort()
-    return available_models
+async def get_groq_models() -> list:
+    return await model_catalog.ids()
+
+
+def get_models_version() -> int:
+    return model_catalog.version
 
 
 async def get_default_model() -> str:
     """Get the default model to use"""
-    global available_models
-    if not available_models:
-        await get_groq_models()
+    available_models = await get_groq_models()
     default_model_name = os.getenv("DEFAULT_GROQ_MODEL", "llama-3.3-70b-versatile")
     if available_models:
         if default_model_name in available_models:
@@ -49,133 +63,254 @@ async def get_default_model() -> str:
         return default_model_name
 
 
+async def get_user_model(context: ContextTypes.DEFAULT_TYPE) -> str:
+    """The user's chat model. The default model is resolved only if none is set"""
+    return context.user_data.get("model") or await get_default_model()
+
+
+async def quota_exceeded_message(
+    error: QuotaExceeded, context: ContextTypes.DEFAULT_TYPE
+) -> str:
+    message = await translate("Too many requests, try again in", context)
+    return f"{message} {error.retry_in:.0f} s"
+
+
+def groq_error_details(error: groq.GroqError) -> tuple[Optional[int], str]:
+    """Status code and message of an API error. Connection errors and
+    timeouts have neither a status code nor a body"""
+    body = getattr(error, "body", None)
+    message = None
+    if isinstance(body, dict):
+        message = (body.get("error") or {}).get("message")
+    return getattr(error, "status_code", None), message or getattr(
+        error, "message", str(error)
+    )
+
+
+async def groq_error_message(
+    status_code: Optional[int], message: str, context: ContextTypes.DEFAULT_TYPE
+) -> str:
+    text = await translate("Groq API returned an error", context)
+    if status_code is None:
+        return f"{text}: {message}"
+    return f"{text}: {status_code} ({message})"
+
+
 async def groq_chat_completion_create(
-    context: ContextTypes.DEFAULT_TYPE, model: str
+    context: ContextTypes.DEFAULT_TYPE,
+    model: str,
+    on_delta: Optional[Callable[[str], Awaitable[None]]] = None,
+    on_complete: Optional[Callable[[str], Awaitable[None]]] = None,
 ) -> str:
+    """Requests a completion for the user's history.
 
-    full_request_content = []
-    prompt_str = context.user_data.get("system_prompt", None)
-    if prompt_str:
-        full_request_content += [{"role": "system", "content": prompt_str}]
+    If ``on_delta`` is given, the completion is streamed and ``on_delta`` is
+    awaited with the whole text generated so far after every chunk.
+    ``on_complete`` is awaited with the answer only if the request succeeded,
+    the error messages returned instead are not passed to it.
+    """
 
-    full_request_content += context.user_data["messages"]
+    history = context.user_data["messages"]
+    await compact_image_history(history)
+    modality = request_modality(model, VISION if has_images(history) else TEXT)
     full_response_content = ""
 
-    try:
-        completion = await chatbot.chat.completions.create(
-            messages=full_request_content,
-            model=model,
-            stream=False,
+    async def request(candidate: str):
+        # Бюджет истории зависит от окна выбранной модели
+        messages = build_request_messages(
+            history,
+            context.user_data.get("system_prompt", None),
+            get_token_budget(candidate),
+        )
+        return await chatbot.chat.completions.create(
+            messages=await resolve_images(messages),
+            model=candidate,
+            stream=on_delta is not None,
         )
 
-        if completion.choices:
-            full_response_content = completion.choices[0].message.content
+    tokens = min(
+        sum(estimate_tokens(message) for message in history), get_token_budget(model)
+    )
+
+    try:
+        async with scheduler.slot(context._user_id, tokens):
+            completion = await model_router.call(
+                modality, model, request, default=await get_default_model()
+            )
 
+            if on_delta is None:
+                if completion.choices:
+                    full_response_content = completion.choices[0].message.content
+            else:
+                try:
+                    async for chunk in completion:
+                        if not chunk.choices:
+                            continue
+                        delta = chunk.choices[0].delta.content
+                        if delta:
+                            full_response_content += delta
+                            await on_delta(full_response_content)
+                finally:
+                    # При отмене соединение освобождается сразу
+                    await completion.close()
+
+        if on_complete:
+            await on_complete(full_response_content)
         return full_response_content
 
+    except QuotaExceeded as e:
+        return await quota_exceeded_message(e, context)
     except groq.GroqError as e:
-
-        message = e.body.get("error", {}).get("message")
-        status_code = e.status_code
+        status_code, message = groq_error_details(e)
         if status_code == 413:
             message += await translate(
                 "\nTry resetting the context. Use the command /new", context
             )
 
-        return f"{await translate("Groq API returned an error", context)}: {status_code} ({message})"
+        return await groq_error_message(status_code, message, context)
+
+
+async def get_ocr_model(context: ContextTypes.DEFAULT_TYPE) -> str:
+    model = await get_user_setting(context._user_id, "ocr_model")
+    if not model:
+        model = await get_user_model(context)
+    return model
 
 
 async def generate_ocr_response(
-    base64_image: str, message: str, context: ContextTypes.DEFAULT_TYPE
+    image_refs: list[str],
+    message: str,
+    context: ContextTypes.DEFAULT_TYPE,
+    on_complete: Optional[Callable[[str], Awaitable[None]]] = None,
 ) -> str:
+    """``image_refs`` are blob store references returned by ``put_blob``, all
+    the images go into one request"""
 
-    model = await get_user_setting(
-        context._user_id,
-        "ocr_model",
-        context.user_data.get("model", await get_default_model()),
-    )
+    model = await get_ocr_model(context)
     context.user_data["messages"] = context.user_data.get("messages", []) + [
         {
             "role": "user",
             "content": [
                 {"type": "text", "text": message},
-                {
-                    "type": "image_url",
-                    "image_url": {
-                        "url": f"data:image/jpeg;base64,{base64_image}",
-                    },
-                },
+                *(image_part(image_ref) for image_ref in image_refs),
             ],
         }
     ]
 
-    return await groq_chat_completion_create(context, model=model)
+    return await groq_chat_completion_create(
+        context, model=model, on_complete=on_complete
+    )
+
+
+async def get_stt_model(context: ContextTypes.DEFAULT_TYPE) -> str:
+    model = await get_user_setting(context._user_id, "stt_model")
+    if not model:
+        model = await get_user_model(context)
+    return model
 
 
-async def generate_stt_response(
-    audio_bytes: BytesIO, message: str, context: ContextTypes.DEFAULT_TYPE
+async def transcribe(
+    audio_file: tuple[str, bytes], message: str, context: ContextTypes.DEFAULT_TYPE
 ) -> str:
-    try:
-        model = await get_user_setting(
-            context._user_id,
-            "stt_model",
-            context.user_data.get("model", await get_default_model()),
-        )
-        transcription = await chatbot.audio.transcriptions.create(
-            file=audio_bytes,
-            model=model,
+    """Transcribes one file or segment, Groq errors are raised. The caller
+    holds the scheduler slot."""
+    model = await get_stt_model(context)
+
+    async def request(candidate: str):
+        return await chatbot.audio.transcriptions.create(
+            file=audio_file,
+            model=candidate,
             prompt=message,
             response_format="text",
         )
-        return transcription
-    except groq.GroqError as e:
 
-        message = e.body.get("error", {}).get("message")
-        status_code = e.status_code
+    return await model_router.call(STT, model, request)
+
+
+async def transcribe_recording(
+    audio_bytes: BytesIO,
+    message: str,
+    context: ContextTypes.DEFAULT_TYPE,
+    duration: Optional[float] = None,
+    on_partial: Optional[Callable[[str], Awaitable[None]]] = None,
+) -> str:
+    """Long recordings are transcribed in segments, ``on_partial`` is awaited
+    with the transcript so far as they finish (see ``transcribe_long_audio``).
+
+    The recording is charged to the quota as one request and holds one
+    scheduler slot, however many segments it is split into.
+
+    Errors are raised, ``stt_error_message`` turns them into the reply.
+    """
+    async with scheduler.slot(context._user_id):
+        # Байты, а не сам поток: запрос может повторяться
+        return await transcribe_long_audio(
+            audio_bytes.getvalue(),
+            getattr(audio_bytes, "name", "audio.ogg"),
+            duration,
+            lambda audio_file: transcribe(audio_file, message, context),
+            on_partial,
+        )
+
+
+async def stt_error_message(
+    error: Exception, context: ContextTypes.DEFAULT_TYPE
+) -> str:
+    if isinstance(error, QuotaExceeded):
+        return await quota_exceeded_message(error, context)
+    if isinstance(error, groq.GroqError):
+        status_code, message = groq_error_details(error)
         if status_code == 413:
-            translate = await translate(
+            hint = await translate(
                 "Try resetting the context. Use the command", context
             )
-            message += f"\n {translate} /new"
+            message += f"\n {hint} /new"
 
-        return f"{await translate("Groq API returned an error", context)}: {status_code} ({message})"
-    except Exception as e:
-        return str(e)
+        return await groq_error_message(status_code, message, context)
+    return str(error)
 
 
 async def generate_tts_response(
     message: str, voice: str, context: ContextTypes.DEFAULT_TYPE
 ) -> str:
-    model = await get_user_setting(
-        context._user_id,
-        "tts_model",
-        context.user_data.get("model", await get_default_model()),
-    )
+    model = await get_user_setting(context._user_id, "tts_model")
+    if not model:
+        model = await get_user_model(context)
     try:
-        response = await chatbot.audio.speech.create(
-            model=model,
-            voice=voice,
-            response_format="wav",
-            input=message,
-        )
+
+        async def request(candidate: str):
+            return await chatbot.audio.speech.create(
+                model=candidate,
+                voice=voice,
+                response_format="wav",
+                input=message,
+            )
+
+        async with scheduler.slot(context._user_id, len(message) // CHARS_PER_TOKEN):
+            response = await model_router.call(TTS, model, request)
         return response
 
+    except QuotaExceeded as e:
+        return await quota_exceeded_message(e, context)
     except groq.GroqError as e:
-        message = e.body.get("error", {}).get("message")
-        status_code = e.status_code
+        status_code, message = groq_error_details(e)
         if status_code == 400:
             return message
-        return f"{await translate("Groq API returned an error", context)}: {status_code} ({message})"
+        return await groq_error_message(status_code, message, context)
     except Exception as e:
         return str(e)
 
 
-async def generate_response(message: str, context: ContextTypes.DEFAULT_TYPE) -> str:
+async def generate_response(
+    message: str,
+    context: ContextTypes.DEFAULT_TYPE,
+    on_delta: Optional[Callable[[str], Awaitable[None]]] = None,
+) -> str:
     context.user_data["messages"] = context.user_data.get("messages", []) + [
         {
             "role": "user",
             "content": message,
         }
     ]
-    model = context.user_data.get("model", await get_default_model())
-    return await groq_chat_completion_create(context, model=model)
+    model = await get_user_model(context)
+    return await groq_chat_completion_create(context, model=model, on_delta=on_delta)
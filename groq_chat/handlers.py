@@ -8,6 +8,8 @@ from translate.translate import translate
 from groq_chat.llm_conversation import send_response
 import groq_chat.command_descriptions as com_descr
 from groq_chat.context import new_chat
+from groq_chat.cancellation import generations
+from groq_chat.work_queue import cancel_jobs
 from db.async_database import set_user_setting
 
 import telegramify_markdown
@@ -45,6 +47,7 @@ async def start(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
 async def new_command_handler(
     update: Update, context: ContextTypes.DEFAULT_TYPE
 ) -> None:
+    await cancel_jobs(update.effective_user.id)
     new_chat(context)
     message = await translate(f"New chat started.\n{com_descr.model}", context)
     if update.callback_query:
@@ -58,6 +61,16 @@ async def new_command_handler(
     )
 
 
+async def stop_command_handler(
+    update: Update, context: ContextTypes.DEFAULT_TYPE
+) -> None:
+    if generations.stop(update):
+        message = await translate("Response generation stopped", context)
+    else:
+        message = await translate("Nothing to stop", context)
+    await update.message.reply_text(message)
+
+
 async def start_system_prompt(
     update: Update, context: ContextTypes.DEFAULT_TYPE
 ) -> None:
@@ -108,6 +121,7 @@ async def get_system_prompt(update: Update, context: ContextTypes.DEFAULT_TYPE)
         context.user_data["system_prompt"] = system_prompt
         message = await translate("System prompt changed", context)
         await update.message.reply_text(message)
+    await cancel_jobs(update.effective_user.id)
     new_chat(context)
     return ConversationHandler.END
 
@@ -0,0 +1,154 @@
+import os
+import time
+import logging
+from typing import Optional
+import httpx
+from telegram.request import HTTPXRequest
+import groq_chat.metrics as metrics
+
+logger = logging.getLogger(__name__)
+
+HTTP2 = os.getenv("HTTP2", "1") == "1"
+HTTP_CONNECT_TIMEOUT = float(os.getenv("HTTP_CONNECT_TIMEOUT", "5"))
+HTTP_POOL_TIMEOUT = float(os.getenv("HTTP_POOL_TIMEOUT", "10"))
+HTTP_KEEPALIVE_EXPIRY = float(os.getenv("HTTP_KEEPALIVE_EXPIRY", "60"))
+
+GROQ_MAX_CONNECTIONS = int(os.getenv("GROQ_MAX_CONNECTIONS", "32"))
+GROQ_MAX_KEEPALIVE = int(os.getenv("GROQ_MAX_KEEPALIVE", "16"))
+GROQ_READ_TIMEOUT = float(os.getenv("GROQ_READ_TIMEOUT", "60"))
+
+TELEGRAM_MAX_CONNECTIONS = int(os.getenv("TELEGRAM_MAX_CONNECTIONS", "32"))
+TELEGRAM_READ_TIMEOUT = float(os.getenv("TELEGRAM_READ_TIMEOUT", "10"))
+TELEGRAM_WRITE_TIMEOUT = float(os.getenv("TELEGRAM_WRITE_TIMEOUT", "20"))
+
+
+def http2_enabled() -> bool:
+    """HTTP/2 needs the optional ``h2`` package (``httpx[http2]``)"""
+    if not HTTP2:
+        return False
+    try:
+        import h2  # noqa: F401
+    except ImportError:
+        logger.warning("Пакет h2 не установлен, используется HTTP/1.1")
+        return False
+    return True
+
+
+def proxy_url() -> Optional[str]:
+    """The proxy of ``PROXY_URL``, or of ``HTTPS_PROXY`` if it is set directly.
+
+    httpx ignores the proxy environment variables when a transport is given,
+    so the transports are created with the proxy explicitly.
+    """
+    return (
+        os.getenv("PROXY_URL")
+        or os.getenv("HTTPS_PROXY")
+        or os.getenv("https_proxy")
+        or None
+    )
+
+
+def request_timeout(read: Optional[float]) -> httpx.Timeout:
+    """Timeout of one request: ``read`` for the answer, short connect and
+    pool waits, so an exhausted pool fails fast instead of hanging"""
+    return httpx.Timeout(read, connect=HTTP_CONNECT_TIMEOUT, pool=HTTP_POOL_TIMEOUT)
+
+
+class PoolMetricsTransport(httpx.AsyncBaseTransport):
+    """Transport with a connection pool that reports its use as metrics.
+
+    The time a request waits for a connection is taken from the httpcore
+    trace events: it ends when a new connection starts to be opened or the
+    request headers start to be sent on a pooled one.
+    """
+
+    def __init__(self, name: str, max_connections: int, max_keepalive: int):
+        self.name = name
+        self.pending = 0
+        self._transport = httpx.AsyncHTTPTransport(
+            http2=http2_enabled(),
+            proxy=proxy_url(),
+            limits=httpx.Limits(
+                max_connections=max_connections,
+                max_keepalive_connections=max_keepalive,
+                keepalive_expiry=HTTP_KEEPALIVE_EXPIRY,
+            ),
+        )
+        metrics.register_gauge(f"{name}_http_requests_pending", lambda: self.pending)
+        metrics.register_gauge(f"{name}_http_connections", self.connections)
+
+    def connections(self) -> int:
+        pool = getattr(self._transport, "_pool", None)
+        return len(pool.connections) if pool is not None else 0
+
+    async def handle_async_request(self, request: httpx.Request) -> httpx.Response:
+        started = time.monotonic()
+        waited = False
+        parent_trace = request.extensions.get("trace")
+
+        async def trace(event: str, info: dict) -> None:
+            nonlocal waited
+            if not waited and event.endswith(
+                ("connect_tcp.started", "send_request_headers.started")
+            ):
+                waited = True
+                metrics.inc(
+                    f"{self.name}_http_pool_wait_seconds_sum",
+                    time.monotonic() - started,
+                )
+                metrics.inc(f"{self.name}_http_pool_wait_seconds_count")
+            if event == "connection.connect_tcp.complete":
+                metrics.inc(f"{self.name}_http_connections_opened_total")
+            if parent_trace is not None:
+                await parent_trace(event, info)
+
+        request.extensions = {**request.extensions, "trace": trace}
+        self.pending += 1
+        try:
+            return await self._transport.handle_async_request(request)
+        except httpx.PoolTimeout:
+            metrics.inc(f"{self.name}_http_pool_timeouts_total")
+            raise
+        finally:
+            self.pending -= 1
+
+    async def aclose(self) -> None:
+        await self._transport.aclose()
+
+
+_groq_transport: Optional[PoolMetricsTransport] = None
+
+
+def groq_http_client(**kwargs) -> httpx.AsyncClient:
+    """Client for one Groq API key.
+
+    The clients of all keys share one connection pool, so the limits hold
+    for the process and HTTP/2 connections are multiplexed between keys.
+    """
+    global _groq_transport
+    if _groq_transport is None:
+        _groq_transport = PoolMetricsTransport(
+            "groq", GROQ_MAX_CONNECTIONS, GROQ_MAX_KEEPALIVE
+        )
+    return httpx.AsyncClient(
+        transport=_groq_transport,
+        timeout=request_timeout(GROQ_READ_TIMEOUT),
+        **kwargs,
+    )
+
+
+def telegram_request(name: str, max_connections: int) -> HTTPXRequest:
+    """Request object for the Bot API with the pool of ``name``"""
+    return HTTPXRequest(
+        connection_pool_size=max_connections,
+        read_timeout=TELEGRAM_READ_TIMEOUT,
+        write_timeout=TELEGRAM_WRITE_TIMEOUT,
+        connect_timeout=HTTP_CONNECT_TIMEOUT,
+        pool_timeout=HTTP_POOL_TIMEOUT,
+        http_version="2" if http2_enabled() else "1.1",
+        httpx_kwargs={
+            "transport": PoolMetricsTransport(
+                name, max_connections, max_connections
+            )
+        },
+    )
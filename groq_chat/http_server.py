@@ -0,0 +1,144 @@
+import os
+import hmac
+import signal
+import asyncio
+import json
+import logging
+from typing import Optional
+from aiohttp import web
+from telegram import Update
+from telegram.ext import Application
+import groq_chat.metrics as metrics
+
+logger = logging.getLogger(__name__)
+
+HTTP_LISTEN = os.getenv("HTTP_LISTEN", "0.0.0.0")
+HTTP_PORT = int(os.getenv("HTTP_PORT", "0"))
+# Публичный адрес бота, например https://bot.example.com. Включает режим webhook
+WEBHOOK_URL = os.getenv("WEBHOOK_URL", "")
+WEBHOOK_PATH = os.getenv("WEBHOOK_PATH", "/telegram")
+WEBHOOK_SECRET_TOKEN = os.getenv("WEBHOOK_SECRET_TOKEN", "")
+WEBHOOK_QUEUE_SIZE = int(os.getenv("WEBHOOK_QUEUE_SIZE", "1000"))
+DEFAULT_WEBHOOK_PORT = 8080
+SECRET_HEADER = "X-Telegram-Bot-Api-Secret-Token"
+
+
+class HttpServer:
+    """Embedded HTTP server with the health and metrics endpoints.
+
+    With ``webhook=True`` it also receives updates from Telegram. An update
+    is acknowledged right after it is accepted and is processed in the
+    background. At most ``queue_size`` accepted updates may be unfinished,
+    further updates get 503 and are redelivered by Telegram later.
+    """
+
+    def __init__(
+        self,
+        app: Optional[Application],
+        webhook: bool,
+        secret_token: str = WEBHOOK_SECRET_TOKEN,
+        queue_size: int = WEBHOOK_QUEUE_SIZE,
+    ):
+        self.app = app
+        self.secret_token = secret_token
+        self.queue_size = queue_size
+        self.pending = 0
+        self._runner: Optional[web.AppRunner] = None
+
+        self.web_app = web.Application()
+        self.web_app.router.add_get("/healthz", self.health)
+        self.web_app.router.add_get("/metrics", self.metrics)
+        if webhook:
+            self.web_app.router.add_post(WEBHOOK_PATH, self.webhook)
+        metrics.register_gauge("webhook_pending_updates", lambda: self.pending)
+
+    async def start(self, listen: str = HTTP_LISTEN, port: int = HTTP_PORT) -> None:
+        self._runner = web.AppRunner(self.web_app, access_log=None)
+        await self._runner.setup()
+        await web.TCPSite(self._runner, listen, port).start()
+        logger.info(f"HTTP сервер запущен на {listen}:{port}")
+
+    async def stop(self) -> None:
+        if self._runner:
+            await self._runner.cleanup()
+
+    def is_running(self) -> bool:
+        return self.app.running
+
+    async def health(self, request: web.Request) -> web.Response:
+        if not self.is_running():
+            return web.Response(status=503, text="stopped")
+        return web.Response(text="ok")
+
+    async def metrics(self, request: web.Request) -> web.Response:
+        return web.Response(text=metrics.render(), content_type="text/plain")
+
+    async def webhook(self, request: web.Request) -> web.Response:
+        if self.secret_token and not hmac.compare_digest(
+            request.headers.get(SECRET_HEADER, ""), self.secret_token
+        ):
+            metrics.inc("webhook_unauthorized_total")
+            return web.Response(status=403)
+
+        try:
+            data = await request.json()
+        except (json.JSONDecodeError, ValueError):
+            data = None
+        if not isinstance(data, dict) or "update_id" not in data:
+            metrics.inc("webhook_bad_request_total")
+            return web.Response(status=400)
+
+        if not await self.dispatch(data):
+            metrics.inc("webhook_rejected_total")
+            return web.Response(status=503)
+
+        metrics.inc("webhook_updates_total")
+        return web.Response()
+
+    async def dispatch(self, data: dict) -> bool:
+        """Starts processing of the update. Returns False if it is rejected"""
+        if self.pending >= self.queue_size:
+            return False
+        update = Update.de_json(data, self.app.bot)
+        self.pending += 1
+        # Без update=: иначе Application записывает данные пользователя даже
+        # для обновлений, которые не обработал ни один обработчик
+        self.app.create_task(self._process(update))
+        return True
+
+    async def _process(self, update: Update) -> None:
+        try:
+            await self.app.update_processor.process_update(
+                update, self.app.process_update(update)
+            )
+        finally:
+            self.pending -= 1
+
+
+async def run_webhook(app: Application) -> None:
+    """Runs the bot receiving updates through the webhook until SIGINT/SIGTERM"""
+    server = HttpServer(app, webhook=True)
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(sig, stop.set)
+
+    async with app:
+        if app.post_init:
+            await app.post_init(app)
+        await app.bot.set_webhook(
+            url=WEBHOOK_URL.rstrip("/") + WEBHOOK_PATH,
+            secret_token=WEBHOOK_SECRET_TOKEN or None,
+            allowed_updates=Update.ALL_TYPES,
+        )
+        await app.start()
+        await server.start(port=HTTP_PORT or DEFAULT_WEBHOOK_PORT)
+        try:
+            await stop.wait()
+        finally:
+            await server.stop()
+            await app.stop()
+            if app.post_stop:
+                await app.post_stop(app)
+    if app.post_shutdown:
+        await app.post_shutdown(app)
@@ -0,0 +1,66 @@
+import io
+import os
+import asyncio
+import logging
+from typing import Sequence
+from PIL import Image, ImageOps, UnidentifiedImageError
+from telegram import PhotoSize
+
+logger = logging.getLogger(__name__)
+
+# Больше этого размера по длинной стороне модели изображение не нужно
+IMAGE_MAX_SIDE = int(os.getenv("IMAGE_MAX_SIDE", "1568"))
+# JPEG или WEBP
+IMAGE_FORMAT = os.getenv("IMAGE_FORMAT", "JPEG").upper()
+IMAGE_QUALITY = int(os.getenv("IMAGE_QUALITY", "85"))
+
+
+def pick_photo_size(sizes: Sequence[PhotoSize]) -> PhotoSize:
+    """The smallest size that still covers ``IMAGE_MAX_SIDE``, the largest
+    one if none does"""
+    ordered = sorted(sizes, key=lambda size: size.width * size.height)
+    for size in ordered:
+        if max(size.width, size.height) >= IMAGE_MAX_SIDE:
+            return size
+    return ordered[-1]
+
+
+def _prepare(data: bytes) -> bytes:
+    with Image.open(io.BytesIO(data)) as image:
+        source_format = image.format
+        image = ImageOps.exif_transpose(image)
+        resized = max(image.size) > IMAGE_MAX_SIDE
+        if resized:
+            image.thumbnail((IMAGE_MAX_SIDE, IMAGE_MAX_SIDE), Image.Resampling.LANCZOS)
+
+        if IMAGE_FORMAT == "WEBP":
+            if image.mode not in ("RGB", "RGBA"):
+                image = image.convert("RGBA" if "A" in image.getbands() else "RGB")
+        elif image.mode != "RGB":
+            # В JPEG нет прозрачности, подкладываем белый фон
+            rgba = image.convert("RGBA")
+            image = Image.new("RGB", rgba.size, "white")
+            image.paste(rgba, mask=rgba.getchannel("A"))
+
+        output = io.BytesIO()
+        image.save(output, IMAGE_FORMAT, quality=IMAGE_QUALITY, optimize=True)
+
+    encoded = output.getvalue()
+    if not resized and source_format == IMAGE_FORMAT and len(encoded) >= len(data):
+        return data
+    return encoded
+
+
+async def prepare_image(data: bytes) -> bytes:
+    """Downscales the image to ``IMAGE_MAX_SIDE`` and re-encodes it in a
+    worker thread. Data that is not a readable image is returned as is."""
+    try:
+        return await asyncio.to_thread(_prepare, data)
+    except (
+        UnidentifiedImageError,
+        Image.DecompressionBombError,
+        OSError,
+        ValueError,
+    ) as e:
+        logger.warning("Не удалось обработать изображение: %s", e)
+        return data
@@ -0,0 +1,193 @@
+import time
+import logging
+from typing import Callable, Optional
+import httpx
+from groq import AsyncGroq, AsyncStream
+from groq_chat.resilience import call_with_retries, endpoint_timeout, parse_duration
+from groq_chat.http_pool import request_timeout
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_COOLDOWN = 10.0
+
+
+def _header_int(headers: httpx.Headers, name: str) -> Optional[int]:
+    try:
+        return int(headers[name])
+    except (KeyError, ValueError):
+        return None
+
+
+class KeyState:
+    """Rate limit state of one API key, taken from the response headers"""
+
+    def __init__(self, index: int, api_key: str):
+        self.index = index
+        self.name = f"key{index}:...{api_key[-4:]}"
+        self.client: Optional[AsyncGroq] = None
+        self.limit_requests: Optional[int] = None
+        self.limit_tokens: Optional[int] = None
+        self.remaining_requests: Optional[int] = None
+        self.remaining_tokens: Optional[int] = None
+        self.requests_reset_at = 0.0
+        self.tokens_reset_at = 0.0
+        self.cooldown_until = 0.0
+        self.in_flight = 0
+
+    def headroom(self, now: float) -> float:
+        """Share of the request and token budgets left, the smaller of both"""
+        shares = [1.0]
+        if self.limit_requests and now < self.requests_reset_at:
+            remaining = (self.remaining_requests or 0) - self.in_flight
+            shares.append(remaining / self.limit_requests)
+        elif self.limit_requests:
+            shares.append(1.0 - self.in_flight / self.limit_requests)
+        if self.limit_tokens and now < self.tokens_reset_at:
+            shares.append((self.remaining_tokens or 0) / self.limit_tokens)
+        return min(shares)
+
+    async def on_response(self, response: httpx.Response) -> None:
+        headers = response.headers
+        now = time.monotonic()
+        limit_requests = _header_int(headers, "x-ratelimit-limit-requests")
+        if limit_requests:
+            self.limit_requests = limit_requests
+        limit_tokens = _header_int(headers, "x-ratelimit-limit-tokens")
+        if limit_tokens:
+            self.limit_tokens = limit_tokens
+        remaining_requests = _header_int(headers, "x-ratelimit-remaining-requests")
+        if remaining_requests is not None:
+            self.remaining_requests = remaining_requests
+            reset = parse_duration(headers.get("x-ratelimit-reset-requests"))
+            self.requests_reset_at = now + (reset or 0)
+        remaining_tokens = _header_int(headers, "x-ratelimit-remaining-tokens")
+        if remaining_tokens is not None:
+            self.remaining_tokens = remaining_tokens
+            reset = parse_duration(headers.get("x-ratelimit-reset-tokens"))
+            self.tokens_reset_at = now + (reset or 0)
+
+        if response.status_code == 429:
+            cooldown = parse_duration(headers.get("retry-after")) or DEFAULT_COOLDOWN
+            self.cooldown_until = now + cooldown
+            logger.warning(f"Ключ {self.name} получил 429, пауза {cooldown:.1f} с")
+
+
+class GroqKeyPool:
+    """Spreads Groq requests over several API keys.
+
+    Each key has its own client, and every response updates the key's rate
+    limit state from the ``x-ratelimit-*`` headers. A request goes to the key
+    with the most headroom, keys that got 429 are skipped until their
+    cooldown ends. The pool is used like an ``AsyncGroq`` client, e.g.
+    ``await pool.chat.completions.create(...)``.
+    """
+
+    def __init__(
+        self,
+        api_keys: list[str],
+        http_client_factory: Callable[..., httpx.AsyncClient] = httpx.AsyncClient,
+    ):
+        if not api_keys:
+            raise ValueError("At least one Groq API key is required")
+        self.keys = []
+        for index, api_key in enumerate(api_keys):
+            state = KeyState(index, api_key)
+            # Повторы выполняются в call_with_retries, с выбором ключа заново
+            state.client = AsyncGroq(
+                api_key=api_key,
+                max_retries=0,
+                http_client=http_client_factory(
+                    event_hooks={"response": [state.on_response]}
+                ),
+            )
+            self.keys.append(state)
+
+    def choose(self) -> KeyState:
+        now = time.monotonic()
+        ready = [key for key in self.keys if key.cooldown_until <= now]
+        if not ready:
+            return min(self.keys, key=lambda key: key.cooldown_until)
+        return max(ready, key=lambda key: (key.headroom(now), -key.in_flight))
+
+    def __getattr__(self, name: str) -> "_PooledResource":
+        return _PooledResource(self, (name,))
+
+
+class _CountedStream:
+    """A streamed response that counts as in flight on its key until it is
+    read to the end or closed, not only until the stream is opened"""
+
+    def __init__(self, stream: AsyncStream, key: KeyState):
+        self._stream = stream
+        self._key = key
+        self._finished = False
+
+    def _finish(self) -> None:
+        if not self._finished:
+            self._finished = True
+            self._key.in_flight -= 1
+
+    def __getattr__(self, name: str):
+        return getattr(self._stream, name)
+
+    async def _iterate(self):
+        try:
+            async for chunk in self._stream:
+                yield chunk
+        finally:
+            self._finish()
+
+    def __aiter__(self):
+        return self._iterate()
+
+    async def close(self) -> None:
+        try:
+            await self._stream.close()
+        finally:
+            self._finish()
+
+    async def __aenter__(self) -> "_CountedStream":
+        return self
+
+    async def __aexit__(self, *exc_info) -> None:
+        await self.close()
+
+
+class _PooledResource:
+    def __init__(self, pool: GroqKeyPool, path: tuple):
+        self._pool = pool
+        self._path = path
+
+    def __getattr__(self, name: str) -> "_PooledResource":
+        return _PooledResource(self._pool, self._path + (name,))
+
+    async def __call__(self, *args, **kwargs):
+        endpoint = ".".join(self._path)
+        timeout = endpoint_timeout(endpoint)
+        if timeout is not None:
+            kwargs.setdefault("timeout", request_timeout(timeout))
+
+        async def attempt():
+            key = self._pool.choose()
+            target = key.client
+            for name in self._path:
+                target = getattr(target, name)
+            key.in_flight += 1
+            try:
+                result = await target(*args, **kwargs)
+            except BaseException:
+                key.in_flight -= 1
+                raise
+            if isinstance(result, AsyncStream):
+                return _CountedStream(result, key)
+            key.in_flight -= 1
+            return result
+
+        return await call_with_retries(endpoint, attempt, kwargs.get("model"))
+
+
+def api_keys_from_env(value: Optional[str], fallback: Optional[str]) -> list[str]:
+    keys = [key.strip() for key in (value or "").split(",") if key.strip()]
+    if not keys and fallback:
+        keys = [fallback]
+    return keys
@@ -0,0 +1,44 @@
+from typing import Awaitable, Callable, Optional
+from telegram import InlineKeyboardMarkup
+from groq_chat.groq_chat import get_models_version
+from translate.translate import fallback_count
+
+
+class KeyboardRegistry:
+    """Keeps built inline keyboards in memory.
+
+    A keyboard is built once per name, language and arguments. All keyboards
+    are dropped when the model list changes. A keyboard with a label whose
+    translation failed is not kept, so it is built again next time.
+    """
+
+    def __init__(self):
+        self._markups: dict = {}
+        self._version = None
+
+    def invalidate(self) -> None:
+        self._markups.clear()
+
+    async def get(
+        self,
+        name: str,
+        lang: Optional[str],
+        builder: Callable[..., Awaitable[InlineKeyboardMarkup]],
+        *args,
+    ) -> InlineKeyboardMarkup:
+        version = get_models_version()
+        if version != self._version:
+            self.invalidate()
+            self._version = version
+
+        key = (name, lang, *args)
+        markup = self._markups.get(key)
+        if markup is None:
+            fallbacks = fallback_count()
+            markup = await builder(lang, *args)
+            if fallback_count() == fallbacks:
+                self._markups[key] = markup
+        return markup
+
+
+keyboards = KeyboardRegistry()
@@ -1,42 +1,133 @@
+import asyncio
 import logging
 from telegram import Update
 from telegram.ext import ContextTypes
 from telegram.constants import ChatAction
-from telegram.error import BadRequest
+from telegram.error import BadRequest, TelegramError
 from groq_chat.groq_chat import (
     generate_response,
     generate_ocr_response,
-    generate_stt_response,
+    transcribe_recording,
+    stt_error_message,
+    get_ocr_model,
+    get_stt_model,
 )
+from groq_chat.blob_store import (
+    put_blob,
+    has_blob,
+    blob_url,
+    image_part,
+    IMAGE_PLACEHOLDER,
+)
+from groq_chat.ocr_cache import find_ocr_answer, remember_ocr_answer, normalize_prompt
+from groq_chat.stt_cache import (
+    content_key,
+    find_transcript,
+    remember_transcript,
+    transcriptions,
+)
+from groq_chat.media_groups import media_groups, ALBUM_MAX_IMAGES
+from groq_chat.image_prep import pick_photo_size, prepare_image
+from groq_chat.memory import schedule_compaction
+from groq_chat.streaming import StreamingReply, STREAM_RESPONSES
+from groq_chat.work_queue import run_queued, CHAT, VISION, STT
+from groq_chat.cancellation import KEEP_PARTIAL_ON_CANCEL, RESET, generations
+from groq_chat.scheduler import scheduler
 from translate.translate import translate
 import telegramify_markdown
 from telegram.constants import ParseMode
 from telegramify_markdown.content import ContentType
 import io
-from telegram import InputFile
+from typing import Optional
+from telegram import InputFile, Message
 import db.async_database as db
-import base64
 from io import BytesIO
 
 logger = logging.getLogger(__name__)
 
 
+def audio_media(message: Message):
+    return message.voice or message.audio or message.document
+
+
 async def llm_audio_request(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    media = audio_media(update.effective_message)
+    # Пересланную запись, которую уже распознавали, не нужно ни скачивать,
+    # ни ставить в очередь
+    cached = await find_transcript(
+        [media.file_unique_id], update.message.caption, await get_stt_model(context)
+    )
+    if cached is not None:
+        await send_response(cached, update, context)
+        return
+
+    await run_queued(STT, update, context, lambda: transcribe_audio(update, context))
+
+
+async def transcribe_audio(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     await update.message.chat.send_action(ChatAction.TYPING)
     try:
-        tg_file = await context.bot.get_file(
-            update.effective_message.voice
-            or update.effective_message.audio
-            or update.effective_message.document
-        )
+        media = audio_media(update.effective_message)
         message = update.message.caption
+        model = await get_stt_model(context)
 
-        bio = BytesIO()
-        await tg_file.download_to_memory(bio)
-        bio.name = "audio_message.ogg"
+        # Части длинной записи показываются по мере распознавания
+        stream = StreamingReply(update, context)
+        waiting = True
 
-        full_output_message = await generate_stt_response(bio, message, context)
-        await send_response(full_output_message, update, context)
+        async def on_partial(text: str) -> None:
+            if not STREAM_RESPONSES or not waiting:
+                return
+            if not stream.messages:
+                await stream.start()
+            await stream.push(text)
+
+        async def download_and_transcribe() -> str:
+            file_keys = [media.file_unique_id]
+            # Могла распознаться, пока задача ждала в очереди
+            cached = await find_transcript(file_keys, message, model)
+            if cached is not None:
+                return cached
+
+            tg_file = await context.bot.get_file(media)
+            bio = BytesIO()
+            await tg_file.download_to_memory(bio)
+            bio.name = "audio_message.ogg"
+
+            # Тот же файл, загруженный заново, получает новый file_unique_id
+            file_keys.append(content_key(bio.getvalue()))
+            cached = await find_transcript(file_keys[1:], message, model)
+            if cached is not None:
+                await remember_transcript(file_keys, message, model, cached)
+                return cached
+
+            transcript = await transcribe_recording(
+                bio,
+                message,
+                context,
+                duration=getattr(media, "duration", None),
+                on_partial=on_partial,
+            )
+            await remember_transcript(file_keys, message, model, transcript)
+            return transcript
+
+        # Одинаковые записи, присланные одновременно, распознаются один раз.
+        # Ошибки общей задачи каждый получает на своем языке, а квота того,
+        # кто присоединился к уже идущему распознаванию, проверяется отдельно
+        key = (media.file_unique_id, normalize_prompt(message), model)
+        try:
+            if transcriptions.in_flight(key):
+                await scheduler.charge(context._user_id)
+            full_output_message = await transcriptions.do(
+                key, download_and_transcribe
+            )
+        except Exception as e:
+            full_output_message = await stt_error_message(e, context)
+        finally:
+            waiting = False
+        await send_response(
+            full_output_message, update, context, drafts=stream.messages
+        )
     except Exception as e:
         if hasattr(e, "message"):
             await send_response(e.message, update, context)
@@ -44,33 +135,128 @@ async def llm_audio_request(update: Update, context: ContextTypes.DEFAULT_TYPE)
             raise e
 
 
+def image_file(message: Message) -> Optional[tuple[str, str]]:
+    """``file_id`` and ``file_unique_id`` of the image in the message"""
+    if message.photo:
+        photo = pick_photo_size(message.photo)
+        return photo.file_id, photo.file_unique_id
+    if message.document and message.document.mime_type.startswith("image/"):
+        return message.document.file_id, message.document.file_unique_id
+    return None
+
+
 async def llm_image_request(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     message = update.message
 
-    if message.photo:
-        file_id = message.photo[-1].file_id
-    elif message.document and message.document.mime_type.startswith("image/"):
-        file_id = message.document.file_id
-    else:
+    file = image_file(message)
+    if file is None:
         text = await translate("This is not an image. Send an image.", context)
         await message.reply_text(text)
         return
 
-    await update.message.chat.send_action(ChatAction.TYPING)
+    if message.media_group_id:
+        # Изображения альбома приходят отдельными обновлениями, отвечаем на все
+        # одним запросом в обработчике первого из них
+        album = await media_groups.collect(message)
+        if album:
+            await run_queued(
+                VISION, update, context, lambda: describe_album(update, context, album)
+            )
+        return
+
+    file_id, file_unique_id = file
+    cached = await find_ocr_answer(
+        context._user_id, file_unique_id, message.caption, await get_ocr_model(context)
+    )
+    if cached is not None:
+        await answer_from_cache(cached, file_unique_id, update, context)
+        return
+
+    # Файл скачивается только когда задача дошла до исполнения
+    await run_queued(
+        VISION,
+        update,
+        context,
+        lambda: describe_image(update, context, file_id, file_unique_id),
+    )
+
 
+async def download_image(
+    context: ContextTypes.DEFAULT_TYPE, file_id: str, file_unique_id: str
+) -> str:
     tg_file = await context.bot.get_file(file_id)
     file_bytes = await tg_file.download_as_bytearray()
+    return await put_blob(await prepare_image(bytes(file_bytes)), key=file_unique_id)
 
-    b64_bytes = base64.b64encode(file_bytes)
-    b64_str = b64_bytes.decode("utf-8")
-    message = update.message.caption
-    if not message:
-        message = await translate("Describe what is shown in the picture", context)
 
-    full_output_message = await generate_ocr_response(b64_str, message, context)
+async def describe_image(
+    update: Update,
+    context: ContextTypes.DEFAULT_TYPE,
+    file_id: str,
+    file_unique_id: str,
+) -> None:
+    await update.message.chat.send_action(ChatAction.TYPING)
+
+    image_ref = await download_image(context, file_id, file_unique_id)
+
+    caption = update.message.caption
+    message = caption or await translate(
+        "Describe what is shown in the picture", context
+    )
+    model = await get_ocr_model(context)
+
+    async def remember(answer: str) -> None:
+        await remember_ocr_answer(
+            context._user_id, file_unique_id, caption, model, answer
+        )
+
+    full_output_message = await generate_ocr_response(
+        [image_ref], message, context, on_complete=remember
+    )
     await send_response(full_output_message, update, context)
 
 
+async def describe_album(
+    update: Update, context: ContextTypes.DEFAULT_TYPE, album: list[Message]
+) -> None:
+    await update.message.chat.send_action(ChatAction.TYPING)
+
+    image_refs = await asyncio.gather(
+        *(download_image(context, *image_file(message)) for message in album)
+    )
+
+    caption = next((message.caption for message in album if message.caption), None)
+    message = caption or await translate(
+        "Describe what is shown in the pictures", context
+    )
+    for start in range(0, len(image_refs), ALBUM_MAX_IMAGES):
+        full_output_message = await generate_ocr_response(
+            image_refs[start : start + ALBUM_MAX_IMAGES], message, context
+        )
+        await send_response(full_output_message, update, context)
+
+
+async def answer_from_cache(
+    answer: str,
+    file_unique_id: str,
+    update: Update,
+    context: ContextTypes.DEFAULT_TYPE,
+) -> None:
+    """Replies with a cached answer, adding the question to the history as if
+    the image was sent to the model"""
+    message = update.message.caption or await translate(
+        "Describe what is shown in the picture", context
+    )
+    if has_blob(file_unique_id):
+        image = image_part(blob_url(file_unique_id))
+    else:
+        image = {"type": "text", "text": IMAGE_PLACEHOLDER}
+    context.user_data["messages"] = context.user_data.get("messages", []) + [
+        {"role": "user", "content": [{"type": "text", "text": message}, image]}
+    ]
+    await send_response(answer, update, context)
+
+
 async def llm_request(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     if "messages" not in context.user_data:
         context.user_data["messages"] = []
@@ -79,15 +265,61 @@ async def llm_request(update: Update, context: ContextTypes.DEFAULT_TYPE) -> Non
     if not message:
         return
 
+    await run_queued(CHAT, update, context, lambda: answer(message, update, context))
+
+
+async def answer(
+    message: str, update: Update, context: ContextTypes.DEFAULT_TYPE
+) -> None:
     await update.message.chat.send_action(ChatAction.TYPING)
 
-    full_output_message = await generate_response(message, context)
-    await send_response(full_output_message, update, context)
+    if not STREAM_RESPONSES:
+        full_output_message = await generate_response(message, context)
+        await send_response(full_output_message, update, context)
+        return
+
+    stream = StreamingReply(update, context)
+    await stream.start()
+    try:
+        full_output_message = await generate_response(
+            message, context, on_delta=stream.push
+        )
+    except asyncio.CancelledError:
+        await finish_cancelled(stream, update, context)
+        raise
+    await send_response(full_output_message, update, context, drafts=stream.messages)
+
+
+async def finish_cancelled(
+    stream: StreamingReply, update: Update, context: ContextTypes.DEFAULT_TYPE
+) -> None:
+    """Keeps the part of a cancelled response that was generated, or removes
+    its drafts. Nothing is kept when the history is being reset."""
+    keep = KEEP_PARTIAL_ON_CANCEL and generations.reason() != RESET
+    try:
+        if keep and stream.text.strip():
+            await send_response(stream.text, update, context, drafts=stream.messages)
+            return
+        for draft in stream.messages:
+            await draft.delete()
+    except TelegramError as e:
+        logger.warning("Не удалось завершить отмененный ответ: %s", e)
 
 
 async def send_response(
-    full_output_message: str, update: Update, context: ContextTypes.DEFAULT_TYPE
+    full_output_message: str,
+    update: Update,
+    context: ContextTypes.DEFAULT_TYPE,
+    drafts: Optional[list[Message]] = None,
 ) -> None:
+    """Sends the formatted response.
+
+    ``drafts`` are messages already posted while the response was streamed.
+    They are edited to hold the formatted text, and the ones left over are
+    deleted.
+    """
+    drafts = list(drafts or [])
+
     # Check user setting for file extraction
     use_file_interpreter = await db.get_user_setting(
         context._user_id, "file_interpreter", False
@@ -103,14 +335,10 @@ async def send_response(
 
     for item in results:
         if item.content_type == ContentType.TEXT:
-            try:
-                await update.message.reply_text(
-                    item.text, entities=[e.to_dict() for e in item.entities]
-                )
-            except BadRequest as e:
-                if "parse" in str(e).lower():
-                    # Если ошибки форматирования, отправляем без него
-                    await update.message.reply_text(item.text)
+            if drafts:
+                await edit_draft(drafts.pop(0), item, update)
+                continue
+            await reply_text_item(item, update)
 
         elif item.content_type == ContentType.PHOTO:
             await context.bot.send_photo(
@@ -135,6 +363,40 @@ async def send_response(
                 ),
             )
 
+    for draft in drafts:
+        try:
+            await draft.delete()
+        except TelegramError as e:
+            logger.warning("Не удалось удалить сообщение: %s", e)
+
     context.user_data["messages"].append(
         {"role": "assistant", "content": full_output_message}
     )
+    schedule_compaction(context)
+
+
+async def reply_text_item(item, update: Update) -> None:
+    try:
+        await update.message.reply_text(
+            item.text, entities=[e.to_dict() for e in item.entities]
+        )
+    except BadRequest as e:
+        if "parse" in str(e).lower():
+            # Если ошибки форматирования, отправляем без него
+            await update.message.reply_text(item.text)
+
+
+async def edit_draft(draft: Message, item, update: Update) -> None:
+    """Puts the formatted text into a draft, or sends it as a new reply if
+    the draft cannot be edited (e.g. the user deleted it)"""
+    try:
+        await draft.edit_text(item.text, entities=[e.to_dict() for e in item.entities])
+    except BadRequest as e:
+        if "Message is not modified" in str(e):
+            return
+        if "parse" in str(e).lower():
+            # Если ошибки форматирования, отправляем без него
+            await draft.edit_text(item.text)
+            return
+        logger.warning("Не удалось изменить черновик ответа: %s", e)
+        await reply_text_item(item, update)
@@ -0,0 +1,208 @@
+import os
+import re
+import shutil
+import asyncio
+import logging
+import tempfile
+from difflib import SequenceMatcher
+from typing import Awaitable, Callable, Optional
+
+logger = logging.getLogger(__name__)
+
+FFMPEG = os.getenv("FFMPEG", "ffmpeg")
+FFPROBE = os.getenv("FFPROBE", "ffprobe")
+# Длина куска записи и перекрытие соседних кусков, в секундах
+STT_CHUNK_SECONDS = float(os.getenv("STT_CHUNK_SECONDS", "300"))
+STT_CHUNK_OVERLAP = float(os.getenv("STT_CHUNK_OVERLAP", "5"))
+# Сколько кусков распознается одновременно
+STT_PARALLEL = int(os.getenv("STT_PARALLEL", "4"))
+# Длительность файлов без нее узнается через ffprobe, если они больше этого
+STT_PROBE_MIN_BYTES = 1024 * 1024
+# Сколько слов на стыке кусков сравнивается при склейке
+MERGE_WINDOW_WORDS = 40
+
+Transcribe = Callable[[tuple[str, bytes]], Awaitable[str]]
+
+
+def ffmpeg_available() -> bool:
+    return shutil.which(FFMPEG) is not None and shutil.which(FFPROBE) is not None
+
+
+def segment_bounds(duration: float) -> list[tuple[float, float]]:
+    """Start and length of the overlapping segments covering the recording"""
+    step = STT_CHUNK_SECONDS - STT_CHUNK_OVERLAP
+    bounds = []
+    start = 0.0
+    while start < duration:
+        bounds.append((start, min(STT_CHUNK_SECONDS, duration - start)))
+        if start + STT_CHUNK_SECONDS >= duration:
+            break
+        start += step
+    return bounds
+
+
+def _normalize(word: str) -> str:
+    return re.sub(r"\W", "", word.lower())
+
+
+def merge_transcripts(left: str, right: str) -> str:
+    """Joins the transcripts of two overlapping segments.
+
+    The words spoken in the overlap appear at the end of ``left`` and at the
+    start of ``right``, possibly cut or recognized a bit differently, so the
+    longest common run of words near the joint is taken as the seam.
+    """
+    left_words = left.split()
+    right_words = right.split()
+    if not left_words or not right_words:
+        return left + right
+    tail = left_words[-MERGE_WINDOW_WORDS:]
+    head = right_words[:MERGE_WINDOW_WORDS]
+    matcher = SequenceMatcher(
+        None, [_normalize(w) for w in tail], [_normalize(w) for w in head], False
+    )
+    match = matcher.find_longest_match(0, len(tail), 0, len(head))
+    if match.size < 2:
+        return " ".join(left_words + right_words)
+    cut = len(left_words) - len(tail) + match.a + match.size
+    return " ".join(left_words[:cut] + right_words[match.b + match.size :])
+
+
+async def _run(*args: str) -> bytes:
+    process = await asyncio.create_subprocess_exec(
+        *args, stdout=asyncio.subprocess.PIPE, stderr=asyncio.subprocess.PIPE
+    )
+    try:
+        stdout, stderr = await process.communicate()
+    except asyncio.CancelledError:
+        process.kill()
+        raise
+    if process.returncode != 0:
+        raise RuntimeError(f"{args[0]}: {stderr.decode(errors='replace')[-300:]}")
+    return stdout
+
+
+async def probe_duration(path: str) -> Optional[float]:
+    try:
+        output = await _run(
+            FFPROBE,
+            "-v",
+            "error",
+            "-show_entries",
+            "format=duration",
+            "-of",
+            "default=noprint_wrappers=1:nokey=1",
+            path,
+        )
+        return float(output.strip())
+    except (RuntimeError, ValueError) as e:
+        logger.warning("Не удалось определить длительность записи: %s", e)
+        return None
+
+
+async def extract_segment(path: str, start: float, length: float) -> bytes:
+    """The segment as 16 kHz mono FLAC, which is what the STT models use"""
+    return await _run(
+        FFMPEG,
+        "-v",
+        "error",
+        "-ss",
+        f"{start:.3f}",
+        "-t",
+        f"{length:.3f}",
+        "-i",
+        path,
+        "-ac",
+        "1",
+        "-ar",
+        "16000",
+        "-f",
+        "flac",
+        "pipe:1",
+    )
+
+
+def _write_temp(data: bytes, suffix: str) -> str:
+    fd, path = tempfile.mkstemp(suffix=suffix)
+    with os.fdopen(fd, "wb") as f:
+        f.write(data)
+    return path
+
+
+async def transcribe_in_segments(
+    path: str,
+    bounds: list[tuple[float, float]],
+    transcribe: Transcribe,
+    on_partial: Optional[Callable[[str], Awaitable[None]]] = None,
+) -> str:
+    """Transcribes the segments concurrently and stitches them in order.
+
+    ``on_partial`` is awaited with the transcript of the leading segments
+    that are done whenever it grows. If a segment fails, the others are
+    cancelled and the error is raised.
+    """
+    limit = asyncio.Semaphore(STT_PARALLEL)
+
+    async def segment(index: int) -> str:
+        start, length = bounds[index]
+        async with limit:
+            data = await extract_segment(path, start, length)
+            return await transcribe((f"segment{index}.flac", data))
+
+    tasks = [asyncio.create_task(segment(index)) for index in range(len(bounds))]
+    results: dict[int, str] = {}
+    merged = ""
+    merged_count = 0
+    try:
+        pending = set(tasks)
+        while pending:
+            done, pending = await asyncio.wait(
+                pending, return_when=asyncio.FIRST_COMPLETED
+            )
+            for task in done:
+                results[tasks.index(task)] = task.result()
+            grew = False
+            while merged_count in results:
+                merged = merge_transcripts(merged, results[merged_count].strip())
+                merged_count += 1
+                grew = True
+            if grew and pending and on_partial:
+                await on_partial(merged)
+    finally:
+        for task in tasks:
+            task.cancel()
+    return merged
+
+
+async def transcribe_long_audio(
+    data: bytes,
+    name: str,
+    duration: Optional[float],
+    transcribe: Transcribe,
+    on_partial: Optional[Callable[[str], Awaitable[None]]] = None,
+) -> str:
+    """Transcribes a recording, splitting it into overlapping segments if it
+    is longer than ``STT_CHUNK_SECONDS``.
+
+    Short recordings, and all of them if ffmpeg is not installed, are sent
+    in one request. ``duration`` is the one reported by Telegram, if any.
+    """
+    might_be_long = (
+        duration > STT_CHUNK_SECONDS
+        if duration is not None
+        else len(data) > STT_PROBE_MIN_BYTES
+    )
+    if not might_be_long or not ffmpeg_available():
+        return await transcribe((name, data))
+
+    path = await asyncio.to_thread(_write_temp, data, os.path.splitext(name)[1])
+    try:
+        if duration is None:
+            duration = await probe_duration(path)
+        if duration is None or duration <= STT_CHUNK_SECONDS:
+            return await transcribe((name, data))
+        bounds = segment_bounds(duration)
+        logger.info(f"Запись {duration:.0f} с распознается кусками: {len(bounds)}")
+        return await transcribe_in_segments(path, bounds, transcribe, on_partial)
+    finally:
+        await asyncio.to_thread(os.remove, path)
@@ -0,0 +1,97 @@
+import os
+import time
+import asyncio
+from typing import Optional
+from telegram import Message, Update
+
+# Сколько ждать следующих изображений альбома после последнего полученного
+MEDIA_GROUP_WINDOW = float(os.getenv("MEDIA_GROUP_WINDOW", "1.0"))
+# Обработанные альбомы помнятся столько секунд
+MEDIA_GROUP_TTL = 120
+# Groq принимает не больше 5 изображений в одном запросе
+ALBUM_MAX_IMAGES = int(os.getenv("ALBUM_MAX_IMAGES", "5"))
+
+
+def is_image_message(message: Message) -> bool:
+    return bool(
+        message.photo
+        or (
+            message.document
+            and message.document.mime_type
+            and message.document.mime_type.startswith("image/")
+        )
+    )
+
+
+class _Group:
+    def __init__(self):
+        self.messages: dict[int, Message] = {}
+        self.last_seen = time.monotonic()
+        self.leader = False
+
+
+class MediaGroups:
+    """Collects the images of an album, which arrive as separate updates.
+
+    The images are registered when their updates arrive (``add_update`` is
+    called by the update processor before the updates of a chat are queued
+    one after another), so the handler of the first image can wait until no
+    more images come and take the whole album. The handlers of the other
+    images then get nothing to do.
+    """
+
+    def __init__(self, window: float):
+        self.window = window
+        self._groups: dict[tuple, _Group] = {}
+        self._done: dict[tuple, float] = {}
+
+    @staticmethod
+    def _key(message: Message) -> tuple:
+        return message.chat_id, message.media_group_id
+
+    def _purge(self, now: float) -> None:
+        for key, seen in list(self._done.items()):
+            if now - seen > MEDIA_GROUP_TTL:
+                del self._done[key]
+        for key, group in list(self._groups.items()):
+            if not group.leader and now - group.last_seen > MEDIA_GROUP_TTL:
+                del self._groups[key]
+
+    def add(self, message: Message) -> Optional[_Group]:
+        if (*self._key(message), message.message_id) in self._done:
+            return None
+        group = self._groups.get(self._key(message))
+        if group is None:
+            group = self._groups[self._key(message)] = _Group()
+        if message.message_id not in group.messages:
+            group.messages[message.message_id] = message
+            group.last_seen = time.monotonic()
+        return group
+
+    def add_update(self, update: object) -> None:
+        if not isinstance(update, Update) or not update.message:
+            return
+        message = update.message
+        if message.media_group_id and is_image_message(message):
+            self.add(message)
+
+    async def collect(self, message: Message) -> list[Message]:
+        """Returns the images of the album, in order, to the handler that
+        should answer it, and an empty list to the others"""
+        self._purge(time.monotonic())
+        group = self.add(message)
+        if group is None or group.leader:
+            return []
+        group.leader = True
+        try:
+            while (wait := group.last_seen + self.window - time.monotonic()) > 0:
+                await asyncio.sleep(wait)
+        finally:
+            del self._groups[self._key(message)]
+            now = time.monotonic()
+            for message_id in group.messages:
+                self._done[(*self._key(message), message_id)] = now
+        return [group.messages[message_id] for message_id in sorted(group.messages)]
+
+
+media_groups = MediaGroups(MEDIA_GROUP_WINDOW)
@@ -0,0 +1,152 @@
+import os
+import logging
+import groq
+from telegram.ext import ContextTypes
+from groq_chat.groq_chat import get_chatbot
+from groq_chat.context_window import estimate_tokens
+from groq_chat.model_catalog import TEXT
+from groq_chat.model_router import model_router
+from groq_chat.scheduler import scheduler, QuotaExceeded
+
+logger = logging.getLogger(__name__)
+
+# Порог размера истории в токенах, после которого старые сообщения сжимаются.
+# 0 - сжатие отключено
+MEMORY_COMPACTION_TOKENS = int(os.getenv("MEMORY_COMPACTION_TOKENS", "0"))
+MEMORY_KEEP_MESSAGES = int(os.getenv("MEMORY_KEEP_MESSAGES", "6"))
+MEMORY_SUMMARY_MODEL = os.getenv("MEMORY_SUMMARY_MODEL", "llama-3.1-8b-instant")
+
+SUMMARY_KEY = "_summary"
+SUMMARY_PREFIX = "Summary of the earlier conversation:\n"
+SUMMARY_INSTRUCTION = (
+    "You maintain a compact memory of a conversation between a user and an "
+    "assistant. Merge the previous summary with the new messages into one "
+    "updated summary. Keep facts, decisions, names, numbers and open questions. "
+    "Answer with the summary only."
+)
+
+_compacting = set()
+
+
+def schedule_compaction(context: ContextTypes.DEFAULT_TYPE) -> None:
+    """Starts a background compaction if the user's history is too long"""
+    if MEMORY_COMPACTION_TOKENS <= 0:
+        return
+    user_id = context._user_id
+    if user_id in _compacting:
+        return
+
+    turns = [
+        message
+        for message in context.user_data.get("messages", [])
+        if message.get("role") != "system"
+    ]
+    if len(turns) <= MEMORY_KEEP_MESSAGES:
+        return
+    if sum(estimate_tokens(message) for message in turns) <= MEMORY_COMPACTION_TOKENS:
+        return
+
+    _compacting.add(user_id)
+    context.application.create_task(
+        compact_history(context.user_data, user_id),
+        name=f"compact_history_{user_id}",
+    )
+
+
+async def compact_history(user_data: dict, user_id: int) -> None:
+    """Replaces old turns of the history with an incremental summary.
+
+    Summarized turns are removed from the history, so only the turns added
+    since the last compaction are sent to the model together with the
+    previous summary and a turn is summarized exactly once. If the history
+    was reset while the summary was generated, the result is dropped.
+    """
+    try:
+        messages = user_data.get("messages", [])
+        summary = find_summary(messages)
+        turns = [message for message in messages if message.get("role") != "system"]
+        old_turns = turns[:-MEMORY_KEEP_MESSAGES]
+        if not old_turns:
+            return
+
+        previous = summary["content"][len(SUMMARY_PREFIX) :] if summary else ""
+        text = await summarize(previous, old_turns, user_id)
+        if not text:
+            return
+
+        current = user_data.get("messages", [])
+        current_ids = {id(message) for message in current}
+        if not all(id(message) in current_ids for message in old_turns):
+            logger.info("История пользователя %s изменилась, сжатие отменено", user_id)
+            return
+        if summary is not None and id(summary) not in current_ids:
+            return
+
+        old_ids = {id(message) for message in old_turns}
+        new_summary = {
+            "role": "system",
+            "content": SUMMARY_PREFIX + text,
+            SUMMARY_KEY: True,
+        }
+        pinned = [
+            message
+            for message in current
+            if message.get("role") == "system" and not message.get(SUMMARY_KEY)
+        ]
+        rest = [
+            message
+            for message in current
+            if message.get("role") != "system" and id(message) not in old_ids
+        ]
+        user_data["messages"] = pinned + [new_summary] + rest
+        logger.info(
+            "История пользователя %s сжата: %s сообщений", user_id, len(old_turns)
+        )
+    except (groq.GroqError, QuotaExceeded) as e:
+        logger.warning("Не удалось сжать историю пользователя %s: %s", user_id, e)
+    finally:
+        _compacting.discard(user_id)
+
+
+def find_summary(messages: list):
+    for message in messages:
+        if message.get(SUMMARY_KEY):
+            return message
+    return None
+
+
+def message_text(message: dict) -> str:
+    content = message.get("content") or ""
+    if isinstance(content, str):
+        return content
+    parts = []
+    for part in content:
+        if part.get("type") == "text":
+            parts.append(part.get("text", ""))
+        else:
+            parts.append("[image]")
+    return " ".join(parts)
+
+
+async def summarize(previous: str, turns: list, user_id: int) -> str:
+    """Like a chat request, the summary is charged to the user's quota and
+    goes through the model router, with retries and the circuit breaker of
+    the pooled client"""
+    dialog = "\n".join(f"{m['role']}: {message_text(m)}" for m in turns)
+    request = f"Previous summary:\n{previous or '(empty)'}\n\nNew messages:\n{dialog}"
+    messages = [
+        {"role": "system", "content": SUMMARY_INSTRUCTION},
+        {"role": "user", "content": request},
+    ]
+
+    async def create(candidate: str):
+        return await get_chatbot().chat.completions.create(
+            messages=messages, model=candidate, stream=False
+        )
+
+    tokens = sum(estimate_tokens(message) for message in messages)
+    async with scheduler.slot(user_id, tokens):
+        completion = await model_router.call(TEXT, MEMORY_SUMMARY_MODEL, create)
+    if completion.choices:
+        return completion.choices[0].message.content
+    return ""
@@ -0,0 +1,26 @@
+from collections import defaultdict
+from typing import Callable
+
+# Счетчики и показатели в формате Prometheus
+_counters: dict = defaultdict(float)
+_gauges: dict[str, Callable[[], float]] = {}
+
+
+def inc(name: str, value: float = 1) -> None:
+    _counters[name] += value
+
+
+def register_gauge(name: str, getter: Callable[[], float]) -> None:
+    """The gauge is read by calling ``getter`` when the metrics are rendered"""
+    _gauges[name] = getter
+
+
+def render() -> str:
+    lines = []
+    for name, value in sorted(_counters.items()):
+        lines.append(f"# TYPE {name} counter")
+        lines.append(f"{name} {value:g}")
+    for name, getter in sorted(_gauges.items()):
+        lines.append(f"# TYPE {name} gauge")
+        lines.append(f"{name} {getter():g}")
+    return "\n".join(lines) + "\n"
@@ -0,0 +1,109 @@
+import os
+import time
+import asyncio
+import logging
+from dataclasses import dataclass
+from typing import Optional
+from groq_chat.single_flight import SingleFlight
+
+logger = logging.getLogger(__name__)
+
+MODELS_CACHE_TTL = float(os.getenv("MODELS_CACHE_TTL", "600"))
+REFRESH = "models"
+
+TEXT = "text"
+VISION = "vision"
+STT = "stt"
+TTS = "tts"
+
+
+@dataclass(frozen=True)
+class ModelInfo:
+    id: str
+    owned_by: Optional[str]
+    context_window: Optional[int]
+    max_completion_tokens: Optional[int]
+    active: bool
+    modality: str
+
+
+def detect_modality(model_id: str) -> str:
+    name = model_id.lower()
+    if "whisper" in name:
+        return STT
+    if "tts" in name or "playai" in name:
+        return TTS
+    if "vision" in name or "llama-4" in name:
+        return VISION
+    return TEXT
+
+
+class ModelCatalog:
+    """Groq models with their metadata, cached for ``ttl`` seconds.
+
+    A stale catalog is still served while it is refreshed in the background,
+    and concurrent refreshes share one request to the API. Only the very
+    first call waits for the API.
+    """
+
+    def __init__(self, ttl: float):
+        self.ttl = ttl
+        self.version = 0
+        self._client = None
+        self._models: dict[str, ModelInfo] = {}
+        self._fetched_at = 0.0
+        self._refreshes = SingleFlight()
+
+    def set_client(self, client) -> None:
+        self._client = client
+
+    async def refresh(self) -> None:
+        await self._refreshes.do(REFRESH, self._fetch)
+
+    async def _fetch(self) -> None:
+        if not self._client:
+            return
+        response = await self._client.models.list()
+        models = {
+            model.id: ModelInfo(
+                id=model.id,
+                owned_by=getattr(model, "owned_by", None),
+                context_window=getattr(model, "context_window", None),
+                max_completion_tokens=getattr(model, "max_completion_tokens", None),
+                active=getattr(model, "active", True) is not False,
+                modality=detect_modality(model.id),
+            )
+            for model in response.data
+        }
+        if models != self._models:
+            self._models = models
+            self.version += 1
+        self._fetched_at = time.monotonic()
+
+    def _refresh_in_background(self) -> None:
+        if self._refreshes.in_flight(REFRESH):
+            return
+        task = self._refreshes.start(REFRESH, self._fetch)
+        task.add_done_callback(self._log_refresh_error)
+
+    @staticmethod
+    def _log_refresh_error(task: asyncio.Task) -> None:
+        if not task.cancelled() and task.exception():
+            logger.warning("Не удалось обновить список моделей: %s", task.exception())
+
+    async def models(self) -> dict[str, ModelInfo]:
+        if not self._models:
+            await self.refresh()
+        elif time.monotonic() - self._fetched_at > self.ttl:
+            self._refresh_in_background()
+        return self._models
+
+    async def ids(self) -> list[str]:
+        return sorted(await self.models())
+
+    def get(self, model_id: str) -> Optional[ModelInfo]:
+        """Returns the cached metadata without waiting for the API"""
+        return self._models.get(model_id)
+
+
+model_catalog = ModelCatalog(MODELS_CACHE_TTL)
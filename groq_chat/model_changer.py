@@ -3,8 +3,10 @@ import logging
 from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup
 from telegram.ext import ContextTypes
 from telegram.constants import ParseMode
-from groq_chat.groq_chat import get_groq_models, generate_response, get_default_model
-from translate.translate import translate
+from groq_chat.groq_chat import get_groq_models, generate_response, get_user_model
+from translate.translate import translate, translate_texts, get_lang
+from groq_chat.keyboards import keyboards
+from groq_chat.model_router import AUTO_MODEL
 import groq_chat.command_descriptions as com_descr
 from groq_chat.context import new_chat
 from telegram.constants import ChatAction
@@ -33,13 +35,9 @@ async def model_command_handler(
     await context.bot.send_chat_action(chat_id, ChatAction.TYPING)
 
     models = await get_groq_models()
-    button_list = [
-        [create_model_key(models[i]), create_model_key(models[i + 1])]
-        for i in range(0, len(models) - len(models) % 2, 2)
-    ]
-    if len(models) % 2 == 1:
-        button_list.append([create_model_key(models[-1])])
-    reply_markup = InlineKeyboardMarkup(button_list)
+    reply_markup = await keyboards.get(
+        "models", None, build_models_keyboard, (AUTO_MODEL, *models)
+    )
     message = await translate("Select model", context)
 
     try:
@@ -52,6 +50,16 @@ async def model_command_handler(
     )
 
 
+async def build_models_keyboard(lang, models: tuple) -> InlineKeyboardMarkup:
+    button_list = [
+        [create_model_key(models[i]), create_model_key(models[i + 1])]
+        for i in range(0, len(models) - len(models) % 2, 2)
+    ]
+    if len(models) % 2 == 1:
+        button_list.append([create_model_key(models[-1])])
+    return InlineKeyboardMarkup(button_list)
+
+
 async def change_model_callback_handler(
     update: Update, context: ContextTypes.DEFAULT_TYPE
 ) -> None:
@@ -95,6 +103,20 @@ def create_key(id: str, descriptipn: str) -> InlineKeyboardButton:
     return InlineKeyboardButton(text=descriptipn, callback_data="set_default_" + id)
 
 
+async def build_model_defaults_keyboard(
+    lang: str, model: str
+) -> InlineKeyboardMarkup:
+    ocr, tts, stt = await translate_texts(
+        ["Set default for OCR", "Set default for TTS", "Set default for STT"], lang
+    )
+    button_list = [
+        [create_key(f"ocr_{model}", ocr)],
+        [create_key(f"tts_{model}", tts)],
+        [create_key(f"stt_{model}", stt)],
+    ]
+    return InlineKeyboardMarkup(button_list)
+
+
 async def show_model_info(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     if update.callback_query:
         query = update.callback_query
@@ -104,7 +126,7 @@ async def show_model_info(update: Update, context: ContextTypes.DEFAULT_TYPE) ->
         chat_id = update.effective_chat.id
 
     await context.bot.send_chat_action(chat_id, ChatAction.TYPING)
-    model = context.user_data.get("model", await get_default_model())
+    model = await get_user_model(context)
     message = (
         f"**__{(await translate("Model info", context))}:__**\n"
         f"**{(await translate("Model", context))}**: `{model}`"
@@ -114,28 +136,9 @@ async def show_model_info(update: Update, context: ContextTypes.DEFAULT_TYPE) ->
     if about:
         message += "\n\n" + about
 
-    button_list = [
-        [
-            create_key(
-                f"ocr_{model}",
-                await translate("Set default for OCR", context),
-            ),
-        ],
-        [
-            create_key(
-                f"tts_{model}",
-                await translate("Set default for TTS", context),
-            ),
-        ],
-        [
-            create_key(
-                f"stt_{model}",
-                await translate("Set default for STT", context),
-            ),
-        ],
-    ]
-
-    markup = InlineKeyboardMarkup(button_list)
+    markup = await keyboards.get(
+        "model_defaults", await get_lang(context), build_model_defaults_keyboard, model
+    )
     await context.bot.send_message(
         chat_id=chat_id,
         text=message,
@@ -0,0 +1,219 @@
+import os
+import time
+import logging
+from typing import Awaitable, Callable, Optional, TypeVar
+import groq
+import groq_chat.metrics as metrics
+from groq_chat.model_catalog import (
+    model_catalog,
+    detect_modality,
+    TEXT,
+    VISION,
+    STT,
+    TTS,
+)
+from groq_chat.resilience import parse_duration
+
+logger = logging.getLogger(__name__)
+
+# Значение модели, при котором она выбирается автоматически
+AUTO_MODEL = "auto"
+
+# Переключаться на другую модель того же класса при 429/503 и для явно
+# выбранной модели, для "auto" переключение есть всегда
+MODEL_FALLBACK = os.getenv("MODEL_FALLBACK", "0") == "1"
+MODEL_FALLBACK_ATTEMPTS = int(os.getenv("MODEL_FALLBACK_ATTEMPTS", "3"))
+# Модель из начала списка выбирается, пока она медленнее лучшей не более чем
+# во столько раз
+AUTO_LATENCY_SLACK = float(os.getenv("AUTO_LATENCY_SLACK", "1.5"))
+MODEL_COOLDOWN = float(os.getenv("MODEL_COOLDOWN", "30"))
+
+# Упорядоченные списки моделей для "auto": "model1,model2"
+AUTO_MODELS = {
+    modality: [
+        name.strip()
+        for name in os.getenv(f"AUTO_MODELS_{modality.upper()}", "").split(",")
+        if name.strip()
+    ]
+    for modality in (TEXT, VISION, STT, TTS)
+}
+
+EWMA_ALPHA = 0.2
+ERROR_PENALTY = 4
+
+T = TypeVar("T")
+
+
+class ModelStats:
+    """Latency and error rate of one model, measured on our own calls"""
+
+    def __init__(self):
+        self.latency: Optional[float] = None
+        self.error_rate = 0.0
+        self.cooldown_until = 0.0
+        self.decommissioned = False
+
+    def score(self) -> Optional[float]:
+        if self.latency is None:
+            return None
+        return self.latency * (1 + ERROR_PENALTY * self.error_rate)
+
+    def on_success(self, latency: float) -> None:
+        if self.latency is None:
+            self.latency = latency
+        else:
+            self.latency += EWMA_ALPHA * (latency - self.latency)
+        self.error_rate *= 1 - EWMA_ALPHA
+
+    def on_failure(self, cooldown: float) -> None:
+        self.error_rate += EWMA_ALPHA * (1 - self.error_rate)
+        self.cooldown_until = max(self.cooldown_until, time.monotonic() + cooldown)
+
+
+def error_code(error: groq.GroqError) -> Optional[str]:
+    body = getattr(error, "body", None)
+    if not isinstance(body, dict):
+        return None
+    return (body.get("error") or {}).get("code")
+
+
+def is_decommissioned(error: Exception) -> bool:
+    status_code = getattr(error, "status_code", None)
+    return status_code == 404 or (
+        status_code == 400 and error_code(error) == "model_decommissioned"
+    )
+
+
+def is_overloaded(error: Exception) -> bool:
+    return getattr(error, "status_code", None) in (429, 503)
+
+
+class ModelRouter:
+    """Picks the model for a request and fails over to the next one.
+
+    Candidates are the models of the same capability class (text, vision,
+    STT, TTS). For ``auto`` they are taken in the order of ``AUTO_MODELS_*``
+    (or the default model first), skipping the ones that are much slower or
+    fail more often than the best of them. A model that answered 429 or 503
+    is put on a cooldown, a decommissioned one is skipped until restart.
+    """
+
+    def __init__(self):
+        self._stats: dict[str, ModelStats] = {}
+
+    def stats(self, model: str) -> ModelStats:
+        stats = self._stats.get(model)
+        if stats is None:
+            stats = self._stats[model] = ModelStats()
+        return stats
+
+    async def _class_models(self, modality: str, default: Optional[str]) -> list:
+        catalog = await model_catalog.models()
+        configured = [m for m in AUTO_MODELS[modality] if m in catalog or not catalog]
+        if configured:
+            return configured
+        models = sorted(
+            (
+                info
+                for info in catalog.values()
+                if info.modality == modality and info.active
+            ),
+            key=lambda info: -(info.context_window or 0),
+        )
+        ranked = [info.id for info in models]
+        if default in ranked:
+            ranked.remove(default)
+            ranked.insert(0, default)
+        return ranked
+
+    async def candidates(
+        self, modality: str, preferred: str, default: Optional[str] = None
+    ) -> list:
+        """Models to try, in order.
+
+        An explicitly chosen model always goes first, the other models of its
+        class follow only if ``MODEL_FALLBACK`` is on. TTS never falls back,
+        the user's voice belongs to one model.
+        """
+        if preferred != AUTO_MODEL and (modality == TTS or not MODEL_FALLBACK):
+            return [preferred]
+
+        now = time.monotonic()
+        ranked = await self._class_models(modality, default)
+        ranked = [m for m in ranked if not self.stats(m).decommissioned]
+        ready = [m for m in ranked if self.stats(m).cooldown_until <= now]
+        cooling = sorted(
+            (m for m in ranked if m not in ready),
+            key=lambda m: self.stats(m).cooldown_until,
+        )
+
+        scores = [s for s in (self.stats(m).score() for m in ready) if s is not None]
+        if scores:
+            limit = min(scores) * AUTO_LATENCY_SLACK
+            fast = [m for m in ready if (self.stats(m).score() or 0) <= limit]
+            slow = sorted(
+                (m for m in ready if m not in fast),
+                key=lambda m: self.stats(m).score(),
+            )
+            ready = fast + slow
+        ordered = ready + cooling
+
+        if preferred != AUTO_MODEL:
+            ordered = [preferred] + [m for m in ordered if m != preferred]
+        return ordered[: 1 if modality == TTS else MODEL_FALLBACK_ATTEMPTS]
+
+    async def call(
+        self,
+        modality: str,
+        preferred: str,
+        request: Callable[[str], Awaitable[T]],
+        default: Optional[str] = None,
+    ) -> T:
+        """Awaits ``request(model)`` for the candidates until one succeeds.
+
+        Only overload and decommission errors move on to the next model, any
+        other error is raised right away.
+        """
+        models = await self.candidates(modality, preferred, default)
+        if not models:
+            models = [default or preferred]
+
+        for index, model in enumerate(models):
+            started = time.monotonic()
+            try:
+                result = await request(model)
+            except groq.GroqError as e:
+                stats = self.stats(model)
+                if is_decommissioned(e):
+                    stats.decommissioned = True
+                elif is_overloaded(e):
+                    response = getattr(e, "response", None)
+                    retry_after = None
+                    if response is not None:
+                        retry_after = parse_duration(
+                            response.headers.get("retry-after")
+                        )
+                    stats.on_failure(retry_after or MODEL_COOLDOWN)
+                else:
+                    raise
+                if index + 1 >= len(models):
+                    raise
+                metrics.inc("model_fallbacks_total")
+                logger.warning(
+                    f"Модель {model} недоступна ({e.status_code}), "
+                    f"пробуем {models[index + 1]}"
+                )
+                continue
+            self.stats(model).on_success(time.monotonic() - started)
+            return result
+
+
+def request_modality(model: str, fallback: str) -> str:
+    """Capability class of an explicitly chosen model, ``fallback`` for auto"""
+    if model == AUTO_MODEL:
+        return fallback
+    info = model_catalog.get(model)
+    return info.modality if info else detect_modality(model)
+
+
+model_router = ModelRouter()
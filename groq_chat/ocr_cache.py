@@ -0,0 +1,38 @@
+import logging
+from typing import Optional
+from db.async_database import get_ocr_answer, save_ocr_answer, get_user_setting
+
+logger = logging.getLogger(__name__)
+
+
+def normalize_prompt(caption: Optional[str]) -> str:
+    """Captions that differ only in case and spacing ask the same question"""
+    return " ".join((caption or "").lower().split())
+
+
+async def ocr_cache_enabled(user_id: int) -> bool:
+    return await get_user_setting(user_id, "ocr_cache") is not False
+
+
+async def find_ocr_answer(
+    user_id: int, file_unique_id: str, caption: Optional[str], model: str
+) -> Optional[str]:
+    if not await ocr_cache_enabled(user_id):
+        return None
+    return await get_ocr_answer(
+        user_id, file_unique_id, normalize_prompt(caption), model
+    )
+
+
+async def remember_ocr_answer(
+    user_id: int,
+    file_unique_id: str,
+    caption: Optional[str],
+    model: str,
+    answer: str,
+) -> None:
+    if not answer or not await ocr_cache_enabled(user_id):
+        return
+    await save_ocr_answer(
+        user_id, file_unique_id, normalize_prompt(caption), model, answer
+    )
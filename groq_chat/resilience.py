@@ -0,0 +1,186 @@
+import os
+import re
+import time
+import random
+import asyncio
+import logging
+from typing import Awaitable, Callable, Optional, TypeVar
+import groq
+import groq_chat.metrics as metrics
+
+logger = logging.getLogger(__name__)
+
+RETRY_ATTEMPTS = int(os.getenv("GROQ_RETRY_ATTEMPTS", "3"))
+RETRY_BASE_DELAY = float(os.getenv("GROQ_RETRY_BASE_DELAY", "0.5"))
+RETRY_MAX_DELAY = float(os.getenv("GROQ_RETRY_MAX_DELAY", "20"))
+BREAKER_FAILURES = int(os.getenv("GROQ_BREAKER_FAILURES", "5"))
+BREAKER_RESET = float(os.getenv("GROQ_BREAKER_RESET", "30"))
+
+# Таймауты запросов по типам вызовов, в секундах
+ENDPOINT_TIMEOUTS = {
+    "chat.completions.create": float(os.getenv("GROQ_CHAT_TIMEOUT", "60")),
+    "audio.transcriptions.create": float(os.getenv("GROQ_STT_TIMEOUT", "120")),
+    "audio.speech.create": float(os.getenv("GROQ_TTS_TIMEOUT", "60")),
+    "models.list": float(os.getenv("GROQ_MODELS_TIMEOUT", "15")),
+}
+
+T = TypeVar("T")
+
+_DURATION_PART = re.compile(r"(\d+(?:\.\d+)?)(ms|h|m|s)")
+_DURATION_UNITS = {"ms": 0.001, "s": 1, "m": 60, "h": 3600}
+
+
+def parse_duration(value: Optional[str]) -> Optional[float]:
+    """Parses Groq durations like ``2m59.56s`` or ``120ms`` into seconds"""
+    if not value:
+        return None
+    try:
+        return float(value)
+    except ValueError:
+        pass
+    parts = _DURATION_PART.findall(value)
+    if not parts:
+        return None
+    return sum(float(number) * _DURATION_UNITS[unit] for number, unit in parts)
+
+
+class CircuitOpenError(groq.GroqError):
+    """Raised without calling Groq while the endpoint's breaker is open.
+
+    Carries ``status_code`` and ``body`` like the API errors, so the existing
+    error handling turns it into a message for the user.
+    """
+
+    status_code = 503
+
+    def __init__(self, endpoint: str, retry_in: float):
+        message = f"Groq is unavailable, try again in {retry_in:.0f} s"
+        super().__init__(message)
+        self.endpoint = endpoint
+        self.body = {"error": {"message": message}}
+
+
+class CircuitBreaker:
+    """Opens after ``failures`` consecutive failures and lets a single probe
+    call through after ``reset`` seconds"""
+
+    def __init__(self, endpoint: str, failures: int, reset: float):
+        self.endpoint = endpoint
+        self.failures = failures
+        self.reset = reset
+        self.consecutive_failures = 0
+        self.opened_at: Optional[float] = None
+        self.probing = False
+
+    def before_call(self) -> None:
+        if self.opened_at is None:
+            return
+        elapsed = time.monotonic() - self.opened_at
+        if elapsed < self.reset or self.probing:
+            raise CircuitOpenError(self.endpoint, max(self.reset - elapsed, 1))
+        self.probing = True
+
+    def on_success(self) -> None:
+        if self.opened_at is not None:
+            logger.info(f"Groq {self.endpoint}: работа восстановлена")
+        self.consecutive_failures = 0
+        self.opened_at = None
+        self.probing = False
+
+    def on_failure(self) -> None:
+        self.consecutive_failures += 1
+        self.probing = False
+        if self.opened_at is not None or self.consecutive_failures >= self.failures:
+            if self.opened_at is None:
+                logger.error(f"Groq {self.endpoint}: слишком много ошибок, пауза")
+                metrics.inc("groq_breaker_opened_total")
+            self.opened_at = time.monotonic()
+
+
+_breakers: dict[str, CircuitBreaker] = {}
+
+
+def get_breaker(endpoint: str, model: Optional[str] = None) -> CircuitBreaker:
+    """Breakers are kept per model, so one overloaded model does not block
+    the fallback to the others"""
+    name = f"{endpoint} {model}" if model else endpoint
+    breaker = _breakers.get(name)
+    if breaker is None:
+        breaker = _breakers[name] = CircuitBreaker(
+            name, BREAKER_FAILURES, BREAKER_RESET
+        )
+    return breaker
+
+
+def endpoint_timeout(endpoint: str) -> Optional[float]:
+    return ENDPOINT_TIMEOUTS.get(endpoint)
+
+
+def is_retryable(error: Exception) -> bool:
+    if isinstance(error, (groq.APITimeoutError, groq.APIConnectionError)):
+        return True
+    if isinstance(error, groq.APIStatusError):
+        return error.status_code == 429 or error.status_code >= 500
+    return False
+
+
+def is_degradation(error: Exception) -> bool:
+    """429 is a limit of one key, not a sign that Groq itself is degraded"""
+    return is_retryable(error) and getattr(error, "status_code", None) != 429
+
+
+def retry_delay(error: Exception, attempt: int) -> Optional[float]:
+    """Delay before the next attempt, None if waiting makes no sense"""
+    response = getattr(error, "response", None)
+    retry_after = None
+    if response is not None:
+        retry_after = parse_duration(response.headers.get("retry-after"))
+    if retry_after is not None:
+        if retry_after > RETRY_MAX_DELAY:
+            return None
+        return retry_after * random.uniform(1, 1.1)
+    return random.uniform(0, min(RETRY_MAX_DELAY, RETRY_BASE_DELAY * 2**attempt))
+
+
+async def call_with_retries(
+    endpoint: str,
+    attempt_call: Callable[[], Awaitable[T]],
+    model: Optional[str] = None,
+) -> T:
+    """Calls Groq through the endpoint's circuit breaker.
+
+    Rate limits, server errors, timeouts and connection errors are retried
+    with jittered exponential backoff, honoring ``retry-after``.
+    ``attempt_call`` is called anew for every attempt.
+    """
+    breaker = get_breaker(endpoint, model)
+    attempt = 0
+    while True:
+        breaker.before_call()
+        try:
+            result = await attempt_call()
+        except Exception as e:
+            if is_degradation(e):
+                breaker.on_failure()
+            elif breaker.probing:
+                breaker.on_success()
+            if not is_retryable(e) or attempt + 1 >= RETRY_ATTEMPTS:
+                raise
+            delay = retry_delay(e, attempt)
+            if delay is None:
+                raise
+            metrics.inc("groq_retries_total")
+            logger.warning(
+                f"Groq {endpoint}: {type(e).__name__}, повтор через {delay:.1f} с"
+            )
+            attempt += 1
+            await asyncio.sleep(delay)
+            continue
+        except BaseException:
+            # Отмененная пробная попытка ничего не сказала о Groq, но пробу
+            # нужно освободить, иначе следующую никогда не пропустят
+            if breaker.probing:
+                breaker.on_failure()
+            raise
+        breaker.on_success()
+        return result
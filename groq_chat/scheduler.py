@@ -0,0 +1,188 @@
+import os
+import time
+import asyncio
+import logging
+from collections import OrderedDict, deque
+from contextlib import asynccontextmanager
+from typing import Optional
+import groq_chat.metrics as metrics
+from db.async_database import get_user_settings
+
+logger = logging.getLogger(__name__)
+
+# Квоты по умолчанию, 0 - без ограничений
+USER_REQUESTS_PER_MINUTE = int(os.getenv("USER_REQUESTS_PER_MINUTE", "20"))
+USER_TOKENS_PER_MINUTE = int(os.getenv("USER_TOKENS_PER_MINUTE", "30000"))
+# Сколько запрос может подождать пополнения квоты, прежде чем будет отклонен
+QUOTA_MAX_WAIT = float(os.getenv("QUOTA_MAX_WAIT", "5"))
+# Одновременные запросы к Groq от всех пользователей процесса
+GROQ_CONCURRENCY = int(os.getenv("GROQ_CONCURRENCY", "8"))
+
+
+class QuotaExceeded(Exception):
+    def __init__(self, retry_in: float):
+        super().__init__(f"Quota exceeded, retry in {retry_in:.0f} s")
+        self.retry_in = retry_in
+
+
+class TokenBucket:
+    """Holds up to ``per_minute`` units and refills them over a minute"""
+
+    def __init__(self, per_minute: int):
+        self.per_minute = per_minute
+        self.level = float(per_minute)
+        self.updated_at = time.monotonic()
+
+    def _refill(self, now: float) -> None:
+        self.level = min(
+            self.per_minute,
+            self.level + (now - self.updated_at) * self.per_minute / 60,
+        )
+        self.updated_at = now
+
+    def wait_time(self, amount: float, now: float) -> float:
+        if not self.per_minute:
+            return 0.0
+        self._refill(now)
+        # Запрос больше емкости ждет полного ведра, а не вечно
+        missing = min(amount, self.per_minute) - self.level
+        return max(missing, 0) * 60 / self.per_minute
+
+    def take(self, amount: float) -> None:
+        if self.per_minute:
+            self.level -= min(amount, self.per_minute)
+
+
+class UserQuota:
+    def __init__(self, requests_per_minute: int, tokens_per_minute: int):
+        self.requests = TokenBucket(requests_per_minute)
+        self.tokens = TokenBucket(tokens_per_minute)
+
+    def configure(self, requests_per_minute: int, tokens_per_minute: int) -> None:
+        if self.requests.per_minute != requests_per_minute:
+            self.requests = TokenBucket(requests_per_minute)
+        if self.tokens.per_minute != tokens_per_minute:
+            self.tokens = TokenBucket(tokens_per_minute)
+
+    def wait_time(self, tokens: int) -> float:
+        now = time.monotonic()
+        return max(
+            self.requests.wait_time(1, now), self.tokens.wait_time(tokens, now)
+        )
+
+    def take(self, tokens: int) -> None:
+        self.requests.take(1)
+        self.tokens.take(tokens)
+
+
+class FairScheduler:
+    """Limits concurrent Groq calls and serves the waiting users in turn.
+
+    Each user has a queue of their own. When a slot frees up it goes to the
+    next user in round-robin order, and users who are admins are served
+    before the others, so one user with many requests cannot hold up the
+    rest. Before queueing, the request is charged to the user's token
+    buckets (requests and estimated tokens per minute).
+    """
+
+    def __init__(self, concurrency: int):
+        self.concurrency = concurrency
+        self.active = 0
+        self._queues: OrderedDict[int, deque] = OrderedDict()
+        self._admins: set[int] = set()
+        self._quotas: dict[int, UserQuota] = {}
+        metrics.register_gauge("scheduler_active_requests", lambda: self.active)
+        metrics.register_gauge("scheduler_queued_requests", self.queued)
+
+    def queued(self) -> int:
+        return sum(len(queue) for queue in self._queues.values())
+
+    async def _charge(self, user_id: int, tokens: int) -> bool:
+        """Charges the quota, returns whether the user is an admin"""
+        settings = await get_user_settings(user_id)
+        requests_per_minute = USER_REQUESTS_PER_MINUTE
+        tokens_per_minute = USER_TOKENS_PER_MINUTE
+        if settings is not None:
+            if settings.requests_per_minute is not None:
+                requests_per_minute = settings.requests_per_minute
+            if settings.tokens_per_minute is not None:
+                tokens_per_minute = settings.tokens_per_minute
+
+        quota = self._quotas.get(user_id)
+        if quota is None:
+            quota = self._quotas[user_id] = UserQuota(
+                requests_per_minute, tokens_per_minute
+            )
+        quota.configure(requests_per_minute, tokens_per_minute)
+
+        wait = quota.wait_time(tokens)
+        if wait > QUOTA_MAX_WAIT:
+            metrics.inc("quota_rejections_total")
+            raise QuotaExceeded(wait)
+        if wait:
+            await asyncio.sleep(wait)
+        quota.take(tokens)
+        return bool(settings and settings.admin)
+
+    async def _acquire(self, user_id: int, admin: bool) -> None:
+        waiter = asyncio.get_running_loop().create_future()
+        self._queues.setdefault(user_id, deque()).append(waiter)
+        if admin:
+            self._admins.add(user_id)
+        self._grant()
+        try:
+            await waiter
+        except asyncio.CancelledError:
+            if waiter.done() and not waiter.cancelled():
+                # Слот уже выдан, возвращаем его
+                self._release()
+            raise
+
+    def _next_user(self) -> int:
+        for user_id in self._queues:
+            if user_id in self._admins:
+                return user_id
+        return next(iter(self._queues))
+
+    def _grant(self) -> None:
+        while self.active < self.concurrency and self._queues:
+            user_id = self._next_user()
+            queue = self._queues.pop(user_id)
+            waiter = queue.popleft()
+            if queue:
+                # Пользователь уходит в конец очереди
+                self._queues[user_id] = queue
+            else:
+                self._admins.discard(user_id)
+            if waiter.done():
+                continue
+            waiter.set_result(None)
+            self.active += 1
+
+    def _release(self) -> None:
+        self.active -= 1
+        self._grant()
+
+    async def charge(self, user_id: int, tokens: int = 0) -> None:
+        """Charges the quota for a request that needs no Groq call of its own,
+        raises ``QuotaExceeded`` like ``slot``"""
+        await self._charge(user_id, tokens)
+
+    @asynccontextmanager
+    async def slot(self, user_id: Optional[int], tokens: int = 0):
+        """Holds a slot for one Groq call of the user.
+
+        Raises ``QuotaExceeded`` if the user's quota does not refill within
+        ``QUOTA_MAX_WAIT`` seconds. Calls without a user bypass the quotas.
+        """
+        admin = True
+        if user_id is not None:
+            admin = await self._charge(user_id, tokens)
+        await self._acquire(user_id if user_id is not None else 0, admin)
+        try:
+            yield
+        finally:
+            self._release()
+
+
+scheduler = FairScheduler(GROQ_CONCURRENCY)
@@ -0,0 +1,276 @@
+import os
+import zlib
+import queue
+import signal
+import asyncio
+import logging
+import multiprocessing
+from typing import Optional
+from telegram import Bot, Update
+from telegram.error import TelegramError
+
+import groq_chat.metrics as metrics
+from groq_chat.http_pool import telegram_request
+from groq_chat.http_server import (
+    HttpServer,
+    HTTP_PORT,
+    WEBHOOK_URL,
+    WEBHOOK_PATH,
+    WEBHOOK_SECRET_TOKEN,
+    DEFAULT_WEBHOOK_PORT,
+)
+
+logger = logging.getLogger(__name__)
+
+# Размер очереди обновлений каждого рабочего процесса
+WORKER_QUEUE_SIZE = int(os.getenv("WORKER_QUEUE_SIZE", "1000"))
+WORKER_STOP_TIMEOUT = float(os.getenv("WORKER_STOP_TIMEOUT", "30"))
+POLLING_TIMEOUT = 30
+_STOP = None
+
+
+def update_owner_id(data: dict) -> int:
+    """Returns the id of the user who sent the update, or of its chat"""
+    for value in data.values():
+        if not isinstance(value, dict):
+            continue
+        for key in ("from", "user", "chat"):
+            owner = value.get(key)
+            if isinstance(owner, dict) and "id" in owner:
+                return owner["id"]
+        message = value.get("message")
+        if isinstance(message, dict) and "chat" in message:
+            return message["chat"]["id"]
+    return 0
+
+
+def shard_for(owner_id: int, shards: int) -> int:
+    return zlib.crc32(str(owner_id).encode()) % shards
+
+
+def run_worker(index: int, updates: multiprocessing.Queue, log_level: int) -> None:
+    """Entry point of a worker process"""
+    logging.basicConfig(
+        level=log_level,
+        format=f"%(asctime)s - worker {index} - %(name)s - %(levelname)s - %(message)s",
+    )
+    from groq_chat.bot import build_application
+
+    asyncio.run(serve_worker(build_application(shard=index), updates))
+
+
+async def serve_worker(app, updates: multiprocessing.Queue) -> None:
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        # Останавливается супервизор, он и пришлет сигнал остановки
+        loop.add_signal_handler(sig, lambda: None)
+
+    # Следующее обновление берется из очереди, только когда есть место,
+    # иначе очередь всегда пуста и ограничение ее размера не срабатывает
+    slots = asyncio.Semaphore(app.update_processor.max_concurrent_updates)
+
+    async def process(update: Update) -> None:
+        try:
+            await app.update_processor.process_update(
+                update, app.process_update(update)
+            )
+        finally:
+            slots.release()
+
+    async with app:
+        if app.post_init:
+            await app.post_init(app)
+        await app.start()
+        try:
+            while True:
+                await slots.acquire()
+                data = await loop.run_in_executor(None, updates.get)
+                if data is _STOP:
+                    break
+                update = Update.de_json(data, app.bot)
+                # Без update=, как в HttpServer.dispatch
+                app.create_task(process(update))
+        finally:
+            await app.stop()
+            if app.post_stop:
+                await app.post_stop(app)
+    if app.post_shutdown:
+        await app.post_shutdown(app)
+
+
+class ShardedHttpServer(HttpServer):
+    """HTTP server of the supervisor, which passes updates to the workers"""
+
+    def __init__(self, supervisor: "Supervisor", webhook: bool):
+        super().__init__(None, webhook=webhook)
+        self.supervisor = supervisor
+        metrics.register_gauge("webhook_pending_updates", supervisor.pending)
+
+    def is_running(self) -> bool:
+        return self.supervisor.running
+
+    async def dispatch(self, data: dict) -> bool:
+        return self.supervisor.route(data, block=False)
+
+
+class Supervisor:
+    """Runs ``workers`` bot processes and routes each update to one of them.
+
+    The worker is chosen by hashing the user id, so all updates of a user
+    are processed, in order, by the same worker, which holds the user's
+    state. The supervisor receives the updates itself through long polling
+    or the webhook, and restarts workers that exit.
+    """
+
+    def __init__(self, workers: int, log_level: int):
+        self.workers = workers
+        self.log_level = log_level
+        self.running = False
+        self._context = multiprocessing.get_context("spawn")
+        self._queues = [self._context.Queue(WORKER_QUEUE_SIZE) for _ in range(workers)]
+        self._processes: list[Optional[multiprocessing.Process]] = [None] * workers
+        metrics.register_gauge("supervisor_workers_alive", self._alive)
+
+    def _alive(self) -> int:
+        return sum(1 for p in self._processes if p is not None and p.is_alive())
+
+    def pending(self) -> int:
+        """Updates routed to the workers and not yet taken by them"""
+        try:
+            return sum(updates.qsize() for updates in self._queues)
+        except NotImplementedError:
+            return 0
+
+    def _start_worker(self, index: int) -> None:
+        process = self._context.Process(
+            target=run_worker,
+            args=(index, self._queues[index], self.log_level),
+            name=f"groq-chat-worker-{index}",
+        )
+        process.start()
+        self._processes[index] = process
+        logger.info(f"Запущен рабочий процесс {index} (pid {process.pid})")
+
+    def route(self, data: dict, block: bool = True) -> bool:
+        index = shard_for(update_owner_id(data), self.workers)
+        try:
+            self._queues[index].put(data, block=block)
+        except queue.Full:
+            return False
+        return True
+
+    async def _watch_workers(self) -> None:
+        while self.running:
+            await asyncio.sleep(5)
+            for index, process in enumerate(self._processes):
+                if self.running and process is not None and not process.is_alive():
+                    logger.error(
+                        f"Рабочий процесс {index} завершился с кодом {process.exitcode}"
+                    )
+                    metrics.inc("supervisor_worker_restarts_total")
+                    self._start_worker(index)
+
+    async def _poll(self, bot: Bot) -> None:
+        loop = asyncio.get_running_loop()
+        await bot.delete_webhook()
+        offset = None
+        try:
+            while self.running:
+                try:
+                    updates = await bot.get_updates(
+                        offset=offset,
+                        timeout=POLLING_TIMEOUT,
+                        allowed_updates=Update.ALL_TYPES,
+                    )
+                except TelegramError as e:
+                    logger.warning(f"Ошибка получения обновлений: {e}")
+                    await asyncio.sleep(1)
+                    continue
+                for update in updates:
+                    # Если очередь рабочего заполнена, ждем, не запрашивая новых
+                    await loop.run_in_executor(None, self.route, update.to_dict())
+                    offset = update.update_id + 1
+        finally:
+            if offset is not None:
+                # Подтверждаем переданные обновления, иначе после перезапуска
+                # Telegram пришлет их снова
+                try:
+                    await bot.get_updates(offset=offset, timeout=0, limit=1)
+                except TelegramError as e:
+                    logger.warning(f"Не удалось подтвердить обновления: {e}")
+
+    async def run(self) -> None:
+        stop = asyncio.Event()
+        loop = asyncio.get_running_loop()
+        for sig in (signal.SIGINT, signal.SIGTERM):
+            loop.add_signal_handler(sig, stop.set)
+
+        self.running = True
+        for index in range(self.workers):
+            self._start_worker(index)
+        watcher = asyncio.create_task(self._watch_workers())
+
+        server = None
+        async with Bot(
+            os.getenv("BOT_TOKEN"),
+            get_updates_request=telegram_request("telegram_updates", 1),
+        ) as bot:
+            if WEBHOOK_URL:
+                await bot.set_webhook(
+                    url=WEBHOOK_URL.rstrip("/") + WEBHOOK_PATH,
+                    secret_token=WEBHOOK_SECRET_TOKEN or None,
+                    allowed_updates=Update.ALL_TYPES,
+                )
+                server = ShardedHttpServer(self, webhook=True)
+                await server.start(port=HTTP_PORT or DEFAULT_WEBHOOK_PORT)
+                receiver = asyncio.create_task(stop.wait())
+            else:
+                if HTTP_PORT:
+                    server = ShardedHttpServer(self, webhook=False)
+                    await server.start()
+                receiver = asyncio.create_task(self._poll(bot))
+
+            await stop.wait()
+            self.running = False
+            receiver.cancel()
+            watcher.cancel()
+            await asyncio.gather(receiver, return_exceptions=True)
+            if server:
+                await server.stop()
+
+        await asyncio.gather(
+            *(
+                loop.run_in_executor(None, self._stop_worker, index)
+                for index in range(self.workers)
+            )
+        )
+
+    def _stop_worker(self, index: int) -> None:
+        """Lets the worker finish the queued updates, terminating it if its
+        queue stays full"""
+        process = self._processes[index]
+        if process is None:
+            return
+        try:
+            self._queues[index].put(_STOP, timeout=WORKER_STOP_TIMEOUT)
+        except queue.Full:
+            logger.error(f"Очередь рабочего процесса {index} заполнена, остановка")
+            process.terminate()
+        process.join()
+
+
+async def prepare_storage() -> None:
+    """Creates the tables and migrates the pickle file before the workers
+    start, so they do not race to do it"""
+    from db.async_database import initialize_db, get_engine
+    from db.persistence import SqlitePersistence
+
+    await initialize_db()
+    await SqlitePersistence(pickle_filepath="./data/telegram-bot-data").get_user_data()
+    await get_engine().dispose()
+
+
+def start_supervisor(workers: int, log_level: int) -> None:
+    logger.info(f"Starting bot with {workers} worker processes")
+    asyncio.run(prepare_storage())
+    asyncio.run(Supervisor(workers, log_level).run())
@@ -0,0 +1,60 @@
+import asyncio
+import logging
+from typing import Awaitable, Callable, Hashable, TypeVar
+
+logger = logging.getLogger(__name__)
+
+T = TypeVar("T")
+
+
+class _Call:
+    def __init__(self, task: asyncio.Task):
+        self.task = task
+        self.waiters = 0
+        self.detached = False
+
+
+class SingleFlight:
+    """Runs one call per key at a time.
+
+    Callers that come with the same key while the call is in flight wait for
+    it and get the same result or exception. The call runs in a task of its
+    own and is cancelled only when every caller waiting for it has been
+    cancelled, unless it was started in the background with ``start``.
+    """
+
+    def __init__(self):
+        self._calls: dict[Hashable, _Call] = {}
+
+    def _forget(self, key: Hashable, call: _Call) -> None:
+        if self._calls.get(key) is call:
+            del self._calls[key]
+
+    def _call(self, key: Hashable, work: Callable[[], Awaitable[T]]) -> _Call:
+        call = self._calls.get(key)
+        if call is None:
+            call = self._calls[key] = _Call(asyncio.ensure_future(work()))
+            call.task.add_done_callback(lambda _: self._forget(key, call))
+        else:
+            logger.debug("Ожидается уже выполняемый вызов %s", key)
+        return call
+
+    def in_flight(self, key: Hashable) -> bool:
+        return key in self._calls
+
+    def start(self, key: Hashable, work: Callable[[], Awaitable[T]]) -> asyncio.Task:
+        """Starts the call in the background, or returns the one in flight"""
+        call = self._call(key, work)
+        call.detached = True
+        return call.task
+
+    async def do(self, key: Hashable, work: Callable[[], Awaitable[T]]) -> T:
+        call = self._call(key, work)
+        call.waiters += 1
+        try:
+            return await asyncio.shield(call.task)
+        finally:
+            call.waiters -= 1
+            if not call.waiters and not call.detached and not call.task.done():
+                call.task.cancel()
+                self._forget(key, call)
@@ -0,0 +1,97 @@
+import os
+import time
+import logging
+from telegram import Update, Message
+from telegram.ext import ContextTypes
+from telegram.error import BadRequest, RetryAfter, TelegramError
+
+logger = logging.getLogger(__name__)
+
+STREAM_RESPONSES = os.getenv("STREAM_RESPONSES", "true").lower() in ("1", "true", "yes")
+# Telegram допускает примерно одно редактирование в секунду на чат
+STREAM_EDIT_INTERVAL = float(os.getenv("STREAM_EDIT_INTERVAL", "1.5"))
+STREAM_EDIT_MIN_CHARS = int(os.getenv("STREAM_EDIT_MIN_CHARS", "40"))
+STREAM_MESSAGE_LENGTH = 4000
+STREAM_PLACEHOLDER = "…"
+
+
+class StreamingReply:
+    """Shows a completion while it is being generated.
+
+    A placeholder reply is posted first and then edited in place as tokens
+    arrive. Edits are throttled by time and by the amount of new text, and
+    the text rolls over to a new message when it grows past the Telegram
+    message limit. The posted messages are kept in ``messages`` so that
+    ``send_response`` can replace them with the final formatted text.
+    """
+
+    def __init__(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        self.update = update
+        self.context = context
+        self.messages: list[Message] = []
+        self._shown: list[str] = []
+        self._text = ""
+        self._next_edit = 0.0
+
+    @property
+    def text(self) -> str:
+        """The text generated so far, shown or not"""
+        return self._text
+
+    async def start(self) -> None:
+        message = await self.update.effective_message.reply_text(STREAM_PLACEHOLDER)
+        self.messages.append(message)
+        self._shown.append(STREAM_PLACEHOLDER)
+
+    async def push(self, text: str) -> None:
+        """Receives the whole text generated so far"""
+        self._text = text
+        if time.monotonic() < self._next_edit:
+            return
+        if len(text) - sum(len(s) for s in self._shown) < STREAM_EDIT_MIN_CHARS:
+            if self._shown[-1] != STREAM_PLACEHOLDER:
+                return
+        await self._render()
+
+    async def _render(self) -> None:
+        pages = split_text(self._text, STREAM_MESSAGE_LENGTH)
+        for index, page in enumerate(pages):
+            if index < len(self.messages):
+                if self._shown[index] != page:
+                    await self._edit(index, page)
+            else:
+                try:
+                    message = await self.update.effective_message.reply_text(page)
+                except RetryAfter as e:
+                    self._next_edit = time.monotonic() + e.retry_after
+                    return
+                self.messages.append(message)
+                self._shown.append(page)
+        self._next_edit = time.monotonic() + STREAM_EDIT_INTERVAL
+
+    async def _edit(self, index: int, text: str) -> None:
+        try:
+            await self.messages[index].edit_text(text)
+            self._shown[index] = text
+        except RetryAfter as e:
+            self._next_edit = time.monotonic() + e.retry_after
+        except BadRequest as e:
+            if "Message is not modified" in str(e):
+                self._shown[index] = text
+            else:
+                logger.warning("Не удалось обновить сообщение: %s", e)
+        except TelegramError as e:
+            logger.warning("Не удалось обновить сообщение: %s", e)
+
+
+def split_text(text: str, max_length: int) -> list[str]:
+    """Splits text into pages, preferring line breaks as page boundaries"""
+    pages = []
+    while len(text) > max_length:
+        cut = text.rfind("\n", 0, max_length)
+        if cut <= 0:
+            cut = max_length
+        pages.append(text[:cut])
+        text = text[cut:].lstrip("\n")
+    pages.append(text)
+    return [page for page in pages if page.strip()]
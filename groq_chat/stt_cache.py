@@ -0,0 +1,34 @@
+import hashlib
+from typing import Optional
+from db.async_database import get_stt_transcript, save_stt_transcript
+from groq_chat.ocr_cache import normalize_prompt
+from groq_chat.single_flight import SingleFlight
+
+
+def content_key(data: bytes) -> str:
+    """Key of a file by its content, the same audio uploaded again gets a new
+    ``file_unique_id`` but the same key"""
+    return "sha256:" + hashlib.sha256(data).hexdigest()
+
+
+async def find_transcript(
+    file_keys: list[str], caption: Optional[str], model: str
+) -> Optional[str]:
+    for file_key in file_keys:
+        transcript = await get_stt_transcript(
+            file_key, normalize_prompt(caption), model
+        )
+        if transcript is not None:
+            return transcript
+    return None
+
+
+async def remember_transcript(
+    file_keys: list[str], caption: Optional[str], model: str, transcript: str
+) -> None:
+    if not transcript:
+        return
+    await save_stt_transcript(file_keys, normalize_prompt(caption), model, transcript)
+
+
+transcriptions = SingleFlight()
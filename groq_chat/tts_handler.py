@@ -9,6 +9,7 @@ from telegram.ext import ConversationHandler
 
 from groq_chat.handlers import START_TTS, CANCEL_TTS
 from groq_chat.llm_conversation import send_response
+from groq_chat.work_queue import run_queued, TTS
 from db.async_database import get_user_setting, set_user_setting
 
 logger = logging.getLogger(__name__)
@@ -44,6 +45,11 @@ async def cancelled_tts_mode(
 
 
 async def get_tts_message(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    await run_queued(TTS, update, context, lambda: speak(update, context))
+    return ConversationHandler.END
+
+
+async def speak(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     user_message = update.message.text
 
     await context.bot.send_chat_action(
@@ -60,7 +66,7 @@ async def get_tts_message(update: Update, context: ContextTypes.DEFAULT_TYPE) ->
     if isinstance(response_audio, str):
         # Это сообщение об ошибке
         await send_response(response_audio, update, context)
-        return ConversationHandler.END
+        return
 
     audio_bytes: bytes = await response_audio.read()
     audio_io = io.BytesIO(audio_bytes)
@@ -85,8 +91,6 @@ async def get_tts_message(update: Update, context: ContextTypes.DEFAULT_TYPE) ->
         audio=audio_io,
     )
 
-    return ConversationHandler.END
-
 
 async def tts_set_voice_callback(
     update: Update, context: ContextTypes.DEFAULT_TYPE
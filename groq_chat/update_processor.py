@@ -0,0 +1,78 @@
+import asyncio
+from typing import Callable, Optional
+from telegram import Update
+from telegram.ext import BaseUpdateProcessor
+
+
+class ChatOrderedUpdateProcessor(BaseUpdateProcessor):
+    """Processes updates of different chats concurrently.
+
+    Updates of the same chat, and of the same user, are processed one after
+    another in the order they arrived, so ``user_data`` and the
+    ``ConversationHandler`` states are never changed by two updates at once.
+    At most ``max_concurrent_updates`` updates run at the same time, and at
+    most ``max_pending_updates`` are accepted, including the waiting ones.
+    ``on_arrival`` is called with every update before it starts waiting for
+    the earlier updates of its chat.
+    """
+
+    def __init__(
+        self,
+        max_concurrent_updates: int,
+        max_pending_updates: int,
+        on_arrival: Optional[Callable[[object], None]] = None,
+    ):
+        super().__init__(max(max_pending_updates, max_concurrent_updates))
+        self._workers = asyncio.Semaphore(max_concurrent_updates)
+        self._on_arrival = on_arrival
+        self._locks: dict[tuple, asyncio.Lock] = {}
+        self._lock_users: dict[tuple, int] = {}
+
+    @staticmethod
+    def _keys(update: object) -> list:
+        if not isinstance(update, Update):
+            return []
+        keys = []
+        if update.effective_chat:
+            keys.append(("chat", update.effective_chat.id))
+        if update.effective_user:
+            keys.append(("user", update.effective_user.id))
+        return keys
+
+    def _acquire_lock(self, key: tuple) -> asyncio.Lock:
+        lock = self._locks.get(key)
+        if lock is None:
+            lock = self._locks[key] = asyncio.Lock()
+        self._lock_users[key] = self._lock_users.get(key, 0) + 1
+        return lock
+
+    def _release_lock(self, key: tuple) -> None:
+        self._lock_users[key] -= 1
+        if not self._lock_users[key]:
+            del self._lock_users[key]
+            del self._locks[key]
+
+    async def do_process_update(self, update: object, coroutine) -> None:
+        if self._on_arrival:
+            self._on_arrival(update)
+        keys = self._keys(update)
+        locks = [self._acquire_lock(key) for key in keys]
+        acquired = []
+        try:
+            # Блокировки берутся всегда в порядке чат -> пользователь
+            for lock in locks:
+                await lock.acquire()
+                acquired.append(lock)
+            async with self._workers:
+                await coroutine
+        finally:
+            for lock in reversed(acquired):
+                lock.release()
+            for key in keys:
+                self._release_lock(key)
+
+    async def initialize(self) -> None:
+        pass
+
+    async def shutdown(self) -> None:
+        pass
@@ -0,0 +1,216 @@
+import os
+import asyncio
+import logging
+import weakref
+from collections import deque
+from typing import Awaitable, Callable, Optional, TypeVar
+from telegram import Message, Update
+from telegram.ext import ContextTypes
+from telegram.error import TelegramError
+import groq_chat.metrics as metrics
+from groq_chat.cancellation import generations, GenerationCancelled, RESET
+from translate.translate import translate
+
+logger = logging.getLogger(__name__)
+
+CHAT = "chat"
+VISION = "vision"
+STT = "stt"
+TTS = "tts"
+
+# Число одновременно выполняемых задач и длина очереди для каждого вида работы:
+# CHAT_WORKERS, CHAT_QUEUE_SIZE, VISION_WORKERS, ...
+DEFAULT_WORKERS = {CHAT: 8, VISION: 4, STT: 4, TTS: 2}
+DEFAULT_QUEUE_SIZE = 50
+# Сообщение о постановке в очередь отправляется начиная с этой позиции
+QUEUE_NOTICE_POSITION = int(os.getenv("QUEUE_NOTICE_POSITION", "1"))
+
+T = TypeVar("T")
+
+
+class QueueFull(Exception):
+    pass
+
+
+class WorkQueue:
+    """Runs at most ``workers`` jobs of one kind at a time.
+
+    Up to ``max_size`` more jobs wait in FIFO order, any further job is
+    rejected with ``QueueFull`` instead of piling up.
+    """
+
+    def __init__(self, kind: str, workers: int, max_size: int):
+        self.kind = kind
+        self.workers = workers
+        self.max_size = max_size
+        self.active = 0
+        self._waiting: deque[asyncio.Future] = deque()
+        metrics.register_gauge(f"work_queue_{kind}_active", lambda: self.active)
+        metrics.register_gauge(
+            f"work_queue_{kind}_waiting", lambda: len(self._waiting)
+        )
+
+    async def run(
+        self,
+        job: Callable[[], Awaitable[T]],
+        on_queued: Optional[Callable[[int], Awaitable[None]]] = None,
+        on_started: Optional[Callable[[], Awaitable[None]]] = None,
+    ) -> T:
+        """Awaits ``job()`` once a worker is free.
+
+        ``on_queued`` is awaited with the position in the queue if the job
+        has to wait, and ``on_started`` when it leaves the queue.
+        """
+        if self.active < self.workers and not self._waiting:
+            self.active += 1
+        else:
+            if len(self._waiting) >= self.max_size:
+                metrics.inc(f"work_queue_{self.kind}_rejected_total")
+                raise QueueFull(self.kind)
+            waiter = asyncio.get_running_loop().create_future()
+            self._waiting.append(waiter)
+            try:
+                if on_queued:
+                    await on_queued(len(self._waiting))
+                await waiter
+            except BaseException:
+                if waiter.done() and not waiter.cancelled():
+                    self._release()
+                else:
+                    waiter.cancel()
+                    self._waiting.remove(waiter)
+                raise
+            if on_started:
+                await on_started()
+
+        try:
+            return await job()
+        finally:
+            self._release()
+
+    def _release(self) -> None:
+        self.active -= 1
+        while self._waiting and self.active < self.workers:
+            waiter = self._waiting.popleft()
+            if not waiter.done():
+                waiter.set_result(None)
+                self.active += 1
+
+
+work_queues = {
+    kind: WorkQueue(
+        kind,
+        int(os.getenv(f"{kind.upper()}_WORKERS", str(workers))),
+        int(os.getenv(f"{kind.upper()}_QUEUE_SIZE", str(DEFAULT_QUEUE_SIZE))),
+    )
+    for kind, workers in DEFAULT_WORKERS.items()
+}
+
+
+# Последняя поставленная задача каждого пользователя: история у него одна на
+# все чаты, поэтому его задачи выполняются по очереди
+_last_jobs: dict[int, asyncio.Task] = {}
+# Все поставленные и выполняемые задачи каждого пользователя
+_user_jobs: dict[int, set[asyncio.Task]] = {}
+# Задачи, отмененные сбросом истории еще до того, как они начались
+_superseded: weakref.WeakSet[asyncio.Task] = weakref.WeakSet()
+
+
+async def run_queued(
+    kind: str,
+    update: Update,
+    context: ContextTypes.DEFAULT_TYPE,
+    job: Callable[[], Awaitable[T]],
+) -> None:
+    """Puts a handler's job in the queue of its kind and returns.
+
+    The handler does not wait for the job, so a waiting job holds a place in
+    the queue and not a slot of the update processor, which stays free for
+    commands and the other users. The jobs of a user still run one after
+    another in the order they were queued, in all chats.
+    """
+    user_id = update.effective_user.id if update.effective_user else None
+    previous = _last_jobs.get(user_id)
+    task = context.application.create_task(
+        _run_queued(kind, update, context, job, previous), update=update
+    )
+    if user_id is None:
+        return
+    _last_jobs[user_id] = task
+    _user_jobs.setdefault(user_id, set()).add(task)
+
+    def forget(_) -> None:
+        if _last_jobs.get(user_id) is task:
+            del _last_jobs[user_id]
+        jobs = _user_jobs.get(user_id)
+        if jobs is not None:
+            jobs.discard(task)
+            if not jobs:
+                del _user_jobs[user_id]
+
+    task.add_done_callback(forget)
+
+
+async def cancel_jobs(user_id: int) -> None:
+    """Cancels the queued and running jobs of the user and waits until they
+    end, so none of them writes to the history after it is reset"""
+    jobs = _user_jobs.pop(user_id, set())
+    _superseded.update(jobs)
+    generations.cancel_user(user_id, RESET)
+    if jobs:
+        await asyncio.wait(jobs)
+
+
+async def _run_queued(
+    kind: str,
+    update: Update,
+    context: ContextTypes.DEFAULT_TYPE,
+    job: Callable[[], Awaitable[T]],
+    previous: Optional[asyncio.Task],
+) -> None:
+    """Runs the job in the queue, telling the user.
+
+    A waiting user gets a "queued, position N" reply that is edited when the
+    work starts and deleted when it is done. If the queue is full, the user
+    is told so. A cancelled job (see ``Generations``) just ends.
+    """
+    if asyncio.current_task() in _superseded:
+        return
+    notice: Optional[Message] = None
+
+    async def on_queued(position: int) -> None:
+        nonlocal notice
+        if position < QUEUE_NOTICE_POSITION:
+            return
+        text = await translate("Your request is queued, position", context)
+        try:
+            notice = await update.effective_message.reply_text(f"{text} {position}")
+        except TelegramError as e:
+            logger.warning("Не удалось отправить сообщение об очереди: %s", e)
+
+    async def on_started() -> None:
+        if notice is None:
+            return
+        try:
+            await notice.edit_text(await translate("Processing your request", context))
+        except TelegramError as e:
+            logger.warning("Не удалось изменить сообщение об очереди: %s", e)
+
+    async def queued() -> None:
+        if previous is not None:
+            await asyncio.wait([previous])
+        await work_queues[kind].run(job, on_queued, on_started)
+
+    try:
+        await generations.run(generations.key(update), queued())
+    except GenerationCancelled:
+        pass
+    except QueueFull:
+        text = await translate("The bot is busy now, please try again later", context)
+        await update.effective_message.reply_text(text)
+    finally:
+        if notice is not None:
+            try:
+                await notice.delete()
+            except TelegramError as e:
+                logger.warning("Не удалось удалить сообщение: %s", e)
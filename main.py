@@ -1,4 +1,5 @@
 from groq_chat.bot import start_bot
+from groq_chat.sharding import start_supervisor
 import logging
 import os
 
@@ -28,4 +29,8 @@ if __name__ == "__main__":
         level=logger_level,
         format="%(asctime)s - %(name)s - %(levelname)s - %(message)s",
     )
-    start_bot()
+    workers = int(os.getenv("WORKERS", "1"))
+    if workers > 1:
+        start_supervisor(workers, logger_level)
+    else:
+        start_bot()
@@ -0,0 +1,38 @@
+import unittest
+from unittest import mock
+
+import groq
+import httpx
+
+import groq_chat.groq_chat as groq_chat
+
+REQUEST = httpx.Request("POST", "https://api.groq.com/openai/v1/audio/transcriptions")
+
+
+async def same_text(text, context):
+    return text
+
+
+@mock.patch.object(groq_chat, "translate", same_text)
+class GroqErrorTest(unittest.IsolatedAsyncioTestCase):
+    async def test_connection_error_is_reported(self):
+        error = groq.APIConnectionError(request=REQUEST)
+        text = await groq_chat.stt_error_message(error, None)
+        self.assertEqual(text, "Groq API returned an error: Connection error.")
+
+    async def test_timeout_is_reported(self):
+        error = groq.APITimeoutError(request=REQUEST)
+        text = await groq_chat.stt_error_message(error, None)
+        self.assertEqual(text, "Groq API returned an error: Request timed out.")
+
+    async def test_status_error_keeps_code_and_message(self):
+        response = httpx.Response(500, request=REQUEST)
+        error = groq.InternalServerError(
+            "boom", response=response, body={"error": {"message": "Server fault"}}
+        )
+        status_code, message = groq_chat.groq_error_details(error)
+        self.assertEqual((status_code, message), (500, "Server fault"))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,34 @@
+import io
+import unittest
+from unittest import mock
+
+from PIL import Image
+
+from groq_chat import image_prep
+
+
+def png(width: int, height: int) -> bytes:
+    output = io.BytesIO()
+    Image.new("RGB", (width, height), "white").save(output, "PNG")
+    return output.getvalue()
+
+
+class PrepareImageTest(unittest.IsolatedAsyncioTestCase):
+    async def test_decompression_bomb_is_returned_as_is(self):
+        data = png(64, 64)
+        # Больше чем вдвое превышает лимит - Pillow бросает DecompressionBombError
+        with mock.patch.object(Image, "MAX_IMAGE_PIXELS", 100):
+            self.assertEqual(await image_prep.prepare_image(data), data)
+
+    async def test_large_image_is_downscaled(self):
+        data = png(image_prep.IMAGE_MAX_SIDE * 2, 100)
+        prepared = await image_prep.prepare_image(data)
+        with Image.open(io.BytesIO(prepared)) as image:
+            self.assertEqual(image.size, (image_prep.IMAGE_MAX_SIDE, 50))
+
+    async def test_not_an_image_is_returned_as_is(self):
+        self.assertEqual(await image_prep.prepare_image(b"text"), b"text")
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,38 @@
+import asyncio
+import unittest
+from unittest import mock
+
+from groq_chat import resilience
+
+
+class CallWithRetriesTest(unittest.IsolatedAsyncioTestCase):
+    def setUp(self):
+        resilience._breakers.clear()
+
+    async def test_cancelled_probe_lets_the_next_probe_through(self):
+        breaker = resilience.get_breaker("test.endpoint")
+        breaker.opened_at = 0.0
+        started = asyncio.Event()
+
+        async def hang():
+            started.set()
+            await asyncio.sleep(10)
+
+        probe = asyncio.create_task(resilience.call_with_retries("test.endpoint", hang))
+        await started.wait()
+        probe.cancel()
+        with self.assertRaises(asyncio.CancelledError):
+            await probe
+        self.assertFalse(breaker.probing)
+
+        async def ok():
+            return "ok"
+
+        with mock.patch.object(breaker, "reset", 0):
+            result = await resilience.call_with_retries("test.endpoint", ok)
+        self.assertEqual(result, "ok")
+        self.assertIsNone(breaker.opened_at)
+
+
+if __name__ == "__main__":
+    unittest.main()
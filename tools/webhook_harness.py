@@ -0,0 +1,84 @@
+"""Posts synthetic Telegram updates to the bot's webhook.
+
+Start the bot with WEBHOOK_URL set, then run for example
+
+    python tools/webhook_harness.py --url http://127.0.0.1:8080/telegram \
+        --secret "$WEBHOOK_SECRET_TOKEN" --updates 500 --users 50
+
+The script reports the response codes and the acknowledgement latency. The
+updates are text messages from fake users, so the bot's replies to them are
+rejected by Telegram; only the ingestion path is exercised.
+"""
+
+import time
+import asyncio
+import argparse
+from collections import Counter
+import aiohttp
+
+SECRET_HEADER = "X-Telegram-Bot-Api-Secret-Token"
+
+
+def synthetic_update(update_id: int, user_id: int, text: str) -> dict:
+    return {
+        "update_id": update_id,
+        "message": {
+            "message_id": update_id,
+            "date": int(time.time()),
+            "chat": {"id": user_id, "type": "private"},
+            "from": {"id": user_id, "is_bot": False, "first_name": "Harness"},
+            "text": text,
+        },
+    }
+
+
+async def post_update(session, args, update: dict, statuses: Counter, latencies: list):
+    headers = {SECRET_HEADER: args.secret} if args.secret else {}
+    started = time.monotonic()
+    try:
+        async with session.post(args.url, json=update, headers=headers) as response:
+            statuses[response.status] += 1
+    except aiohttp.ClientError as e:
+        statuses[type(e).__name__] += 1
+    latencies.append(time.monotonic() - started)
+
+
+async def main(args) -> None:
+    statuses = Counter()
+    latencies = []
+    semaphore = asyncio.Semaphore(args.concurrency)
+
+    async def worker(update_id: int):
+        update = synthetic_update(
+            args.first_update_id + update_id,
+            args.first_user_id + update_id % args.users,
+            args.text,
+        )
+        async with semaphore:
+            await post_update(session, args, update, statuses, latencies)
+
+    started = time.monotonic()
+    async with aiohttp.ClientSession() as session:
+        await asyncio.gather(*(worker(i) for i in range(args.updates)))
+    elapsed = time.monotonic() - started
+
+    latencies.sort()
+    print(f"updates: {args.updates} in {elapsed:.2f}s")
+    print(f"statuses: {dict(statuses)}")
+    if latencies:
+        p50 = latencies[len(latencies) // 2]
+        p95 = latencies[int(len(latencies) * 0.95) - 1]
+        print(f"ack latency p50: {p50 * 1000:.1f}ms p95: {p95 * 1000:.1f}ms")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--url", default="http://127.0.0.1:8080/telegram")
+    parser.add_argument("--secret", default="")
+    parser.add_argument("--updates", type=int, default=100)
+    parser.add_argument("--users", type=int, default=10)
+    parser.add_argument("--concurrency", type=int, default=20)
+    parser.add_argument("--text", default="/start")
+    parser.add_argument("--first-update-id", type=int, default=1_000_000)
+    parser.add_argument("--first-user-id", type=int, default=9_000_000)
+    asyncio.run(main(parser.parse_args()))
@@ -1,16 +1,33 @@
 from googletrans import Translator
 import os
 import json
-from db.async_database import get_user_setting, set_user_setting
+import asyncio
+from collections import OrderedDict
+from typing import Optional
+from groq_chat.single_flight import SingleFlight
+from db.async_database import (
+    get_user_setting,
+    set_user_setting,
+    get_translation,
+    save_translation,
+)
 
 LANG = os.getenv("LANG", "en")
+TRANSLATION_CACHE_SIZE = int(os.getenv("TRANSLATION_CACHE_SIZE", "5000"))
 
 translator = Translator()
 with open("./translate/messages.json", "r", encoding="utf-8") as f:
     messages = json.load(f)
+# Сколько раз перевод не удался и вместо него был возвращен исходный текст
+_fallbacks = 0
 
+# (text, lang) -> перевод, наиболее востребованные в конце
+_cache: OrderedDict = OrderedDict()
+# Одинаковые запросы перевода не уходят в сеть дважды
+_in_flight = SingleFlight()
 
-async def translate(text, context):
+
+async def get_lang(context) -> str:
     lang = context.user_data.get("LANG", None)
     if not lang:
         chat_id = context._chat_id
@@ -19,7 +36,38 @@ async def translate(text, context):
             await set_user_setting(chat_id, "lang", LANG)
             lang = LANG
         context.user_data["LANG"] = lang
+    return lang
+
+
+def _remember(key: tuple, translation: str) -> None:
+    _cache[key] = translation
+    _cache.move_to_end(key)
+    while len(_cache) > TRANSLATION_CACHE_SIZE:
+        _cache.popitem(last=False)
+
+
+async def _fetch(text: str, lang: str) -> Optional[str]:
+    translation = await get_translation(text, lang)
+    if translation is not None:
+        return translation
+
+    try:
+        result = await translator.translate(text, dest=lang)
+    except Exception as e:
+        print(f"Translation error: {e}")
+        return None
+
+    await save_translation(text, lang, result.text)
+    return result.text
+
+
+def fallback_count() -> int:
+    return _fallbacks
 
+
+async def translate_text(text: str, lang: str) -> str:
+    """Translates text, looking in messages.json, the in-process cache and the
+    translations table before asking Google Translate"""
     if lang == "en":
         return text
 
@@ -30,10 +78,29 @@ async def translate(text, context):
     except KeyError:
         pass
 
-    try:
-        translation = await translator.translate(text, dest=lang)
-        return translation.text
-    except Exception as e:
-        print(f"Translation error: {e}")
+    key = (text, lang)
+    if key in _cache:
+        _cache.move_to_end(key)
+        return _cache[key]
+
+    translation = await _in_flight.do(key, lambda: _fetch(text, lang))
+
+    if translation is None:
+        global _fallbacks
+        _fallbacks += 1
+        return text
+    _remember(key, translation)
+    return translation
+
+
+async def translate(text, context):
+    return await translate_text(text, await get_lang(context))
+
+
+async def translate_texts(texts: list, lang: str) -> list:
+    """Translates several strings concurrently, keeping their order"""
+    return list(await asyncio.gather(*(translate_text(text, lang) for text in texts)))
+
 
-    return text
+async def translate_many(texts: list, context) -> list:
+    return await translate_texts(texts, await get_lang(context))